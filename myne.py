@@ -2,67 +2,519 @@
 
 import hashlib
 import os
+import signal
 import subprocess
 import sys
+import time
 import logging
-from functools import wraps
+import logging.handlers
+import queue
+import re
+import atexit
+import bisect
+from functools import wraps, partial
 import asyncio
-from typing import Tuple, List
+from typing import Tuple, List, Dict, Optional, Deque
 import json
+import glob
+import platform
+import random
+import reprlib
+import tempfile
+import argparse
+
+try:
+    import tomllib
+except ImportError:
+    tomllib = None
+import resource
+from collections import deque
+from dataclasses import dataclass, field, fields, asdict, replace
+from enum import Enum
 
 LOG_TO_FILE = False
+LOG_LEVEL = os.environ.get("MYNE_LOG_LEVEL", "INFO").upper()
+LOG_REPR_LIMIT = 200
 LOG_FILE_PATH = "myne.log"
 LOG_FILE_JSON_PATH = "myne.json"
+LATENCY_HISTOGRAMS = os.environ.get("MYNE_LATENCY_HISTOGRAMS", "") == "1"
+LATENCY_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+LATENCY_DUMP_INTERVAL = 300
+CONFIG_DIR = "/etc/myne"
+CONFIG_PATH = os.environ.get("MYNE_CONFIG")
+CONFIG_NAMES = ("myne.toml", "myne.json")
+CONFIG_WATCH_INTERVAL = 10
+RESTART_SETTINGS = (
+    "stratum_proxy",
+    "proxy_host",
+    "proxy_port",
+    "status_host",
+    "status_port",
+)
+LOG_FILE_MAX_BYTES = 10 * 1024 * 1024
+LOG_FILE_BACKUPS = 5
+LOG_FIELDS = (
+    "worker",
+    "pid",
+    "threads",
+    "hashrate",
+    "returncode",
+    "reason",
+    "duration",
+)
 DEFAULT_HOST = "kelsey-ai.local:3333"
+POOL_HOSTS = [DEFAULT_HOST]
+POOL_PROBE_INTERVAL = 60
+POOL_PROBE_TIMEOUT = 5
+POOL_REJECT_WEIGHT = 10.0
+POOL_RERANK_MARGIN = 0.2
+POOL_STATS_DECAY = 0.9
+STRATUM_PROXY = False
+PROXY_HOST = "127.0.0.1"
+PROXY_PORT = 13333
+PROXY_LOGIN = "x"
+PROXY_PASS = "x"
+PROXY_LOGIN_TIMEOUT = 10
+PROXY_KEEPALIVE = 60
+PROXY_SUBMIT_TIMEOUT = 30
+PROXY_BACKOFF_BASE = 1
+PROXY_BACKOFF_MAX = 60
+PROXY_MAX_CLIENTS = 256
+PROXY_JOB_HISTORY = 8
+STALE_SHARE_ERRORS = ("stale", "expired", "job not found", "invalid job id")
 SCRIPT_PATH = os.path.realpath(__file__)
 LOCAL_SCRIPT_PATH = "/usr/local/bin/myne.py"
-CPULIMIT_PATH = "/usr/bin/cpulimit"
+CGROUP_ROOT = "/sys/fs/cgroup"
 XMRIG_PATH = "/usr/local/bin/xmrig"
 PGREP_CMD = ["pgrep", "xmrig"]
-SLEEP_INTERVAL = 60
+STATE_DIR = "/var/lib/myne"
+XMRIG_CONFIG_DIR = os.path.join(STATE_DIR, "workers")
+RANDOMX_MODE = "fast"
+PROFILE_PATH = os.path.join(STATE_DIR, "profile.json")
+PLAN_CACHE_PATH = os.path.join(STATE_DIR, "plan.json")
+HUGEPAGES_STATE_PATH = os.path.join(STATE_DIR, "hugepages.json")
+AUTO_BENCHMARK = False
+BENCHMARK_SIZE = "1M"
+BENCHMARK_TIMEOUT = 3600
+RAPL_PATH = "/sys/class/powercap"
+RESTART_DELAY = 0.25
+RESTART_BACKOFF_BASE = 1
+RESTART_BACKOFF_MAX = 300
+RESTART_JITTER = 0.2
+HEALTHY_RUNTIME = 60
+CRASH_LOOP_THRESHOLD = 5
+PARKED_CHECK_INTERVAL = 30
+PARKED_RETRY_INTERVAL = 1800
+STOP_TIMEOUT = 10
+WORKER_HISTORY_SIZE = 20
+API_HOST = "127.0.0.1"
+API_PORT_BASE = 18081
+TELEMETRY_INTERVAL = 10
+TELEMETRY_TIMEOUT = 2
+TELEMETRY_HISTORY_SIZE = 360
+TELEMETRY_LOG_INTERVAL = 60
+STALL_GRACE_PERIOD = 300
+STALL_BASELINE_WINDOW = 900
+STALL_HASHRATE_FRACTION = 0.5
+STALL_SHARE_TIMEOUT = 1800
+STALL_BACKOFF_BASE = 30
+STALL_BACKOFF_MAX = 900
+STATUS_HOST = "127.0.0.1"
+STATUS_PORT = 18080
+STATUS_SOCKET = None
+LOOP_LAG_INTERVAL = 1
 CPU_LIMIT_THRESHOLD = 8
 CPU_LIMIT_HIGH = 100
 CPU_LIMIT_LOW = 40
+CPU_MAX_PERIOD = 100000
+LIMITED_NICENESS = 19
 USAGE_LIMIT = 0.85
+THROTTLE_INTERVAL = 5
+THROTTLE_HYSTERESIS = 10
+THROTTLE_SMOOTHING = 0.5
+SYSFS_CPU_PATH = "/sys/devices/system/cpu"
+SYSFS_NODE_PATH = "/sys/devices/system/node"
+RANDOMX_SCRATCHPAD = 2 * 1024 * 1024
+HUGEPAGES_PATH = "/sys/kernel/mm/hugepages"
+HUGEPAGE_SIZE_KB = 2048
+# Every xmrig process allocates its own cache, plus the dataset in fast mode.
+RANDOMX_DATASET_BYTES = 2080 * 1024 * 1024
+RANDOMX_CACHE_BYTES = 256 * 1024 * 1024
+HUGEPAGES_REQUIRED = False
+HUGEPAGES_MEMORY_FRACTION = 0.6
+SET_MEMPOLICY_SYSCALLS = {"x86_64": 238, "aarch64": 237}
+MPOL_PREFERRED = 1
 
-logging.basicConfig(
-    level=logging.DEBUG, format="%(asctime)s - %(levelname)s - %(message)s"
-)
+ANSI_ESCAPE = re.compile(r"\033\[[0-9;]*m")
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": record.created,
+            "level": record.levelname,
+            "message": ANSI_ESCAPE.sub("", record.getMessage()),
+        }
+        for name in LOG_FIELDS:
+            if hasattr(record, name):
+                entry[name] = getattr(record, name)
+        return json.dumps(entry, default=str)
+
+
+logging.basicConfig(level=LOG_LEVEL, format="%(asctime)s - %(levelname)s - %(message)s")
 if LOG_TO_FILE:
-    file_handler = logging.FileHandler(LOG_FILE_PATH)
-    json_handler = logging.FileHandler(LOG_FILE_JSON_PATH)
-    logging.getLogger().addHandler(file_handler)
-    logging.getLogger().addHandler(json_handler)
+    file_handler = logging.handlers.RotatingFileHandler(
+        LOG_FILE_PATH, maxBytes=LOG_FILE_MAX_BYTES, backupCount=LOG_FILE_BACKUPS
+    )
+    file_handler.setFormatter(
+        logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
+    )
+    json_handler = logging.handlers.RotatingFileHandler(
+        LOG_FILE_JSON_PATH, maxBytes=LOG_FILE_MAX_BYTES, backupCount=LOG_FILE_BACKUPS
+    )
+    json_handler.setFormatter(JsonFormatter())
+    # File writes happen on the listener thread, never on the event loop.
+    log_queue = queue.SimpleQueue()
+    log_listener = logging.handlers.QueueListener(
+        log_queue, file_handler, json_handler, respect_handler_level=True
+    )
+    log_listener.start()
+    atexit.register(log_listener.stop)
+    logging.getLogger().addHandler(logging.handlers.QueueHandler(log_queue))
+
+
+_log_repr = reprlib.Repr()
+_log_repr.maxstring = _log_repr.maxother = LOG_REPR_LIMIT
+
+
+class _LazyRepr:
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __str__(self) -> str:
+        return _log_repr.repr(self.value)
+
+
+class LatencyHistogram:
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def record(self, duration: float) -> None:
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, duration)] += 1
+        self.count += 1
+        self.total += duration
+
+    def percentile(self, fraction: float) -> float:
+        target = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target and count:
+                if index < len(LATENCY_BUCKETS):
+                    return LATENCY_BUCKETS[index]
+                return float("inf")
+        return 0.0
+
+
+latency_histograms: Dict[str, LatencyHistogram] = {}
+
+
+def log_latency_histograms() -> None:
+    for name, histogram in sorted(latency_histograms.items()):
+        if not histogram.count:
+            continue
+        logging.info(
+            "\033[94mLatency of %s: %d calls, p50 <= %ss, p95 <= %ss, p99 <= %ss, mean %.4fs\033[0m",
+            name,
+            histogram.count,
+            histogram.percentile(0.5),
+            histogram.percentile(0.95),
+            histogram.percentile(0.99),
+            histogram.total / histogram.count,
+        )
 
 
 def log_decorator(func):
+    # Tracing and timing are decided once at import time; with both off the
+    # function is returned untouched so calls pay nothing for them.
+    trace = logging.getLogger().isEnabledFor(logging.DEBUG)
+    if not trace and not LATENCY_HISTOGRAMS:
+        return func
+    histogram = None
+    if LATENCY_HISTOGRAMS:
+        histogram = latency_histograms.setdefault(func.__name__, LatencyHistogram())
+
     @wraps(func)
     async def wrapper(*args, **kwargs):
-        logging.debug(
-            f"\033[94mCalling function {func.__name__} with args: {args}, kwargs: {kwargs}\033[0m"
-        )
+        if trace:
+            logging.debug(
+                "\033[94mCalling function %s with args: %s, kwargs: %s\033[0m",
+                func.__name__,
+                _LazyRepr(args),
+                _LazyRepr(kwargs),
+            )
+        start = time.perf_counter()
         try:
             result = await func(*args, **kwargs)
-            logging.debug(f"\033[92mFunction {func.__name__} returned: {result}\033[0m")
+            if trace:
+                logging.debug(
+                    "\033[92mFunction %s returned: %s\033[0m",
+                    func.__name__,
+                    _LazyRepr(result),
+                )
             return result
         except Exception as e:
             logging.error(
-                f"\033[91mFunction {func.__name__} raised an exception: {e}\033[0m"
+                "\033[91mFunction %s raised an exception: %s\033[0m", func.__name__, e
             )
             raise
+        finally:
+            if histogram is not None:
+                histogram.record(time.perf_counter() - start)
 
     return wrapper
 
 
-@log_decorator
-async def calculate_file_hash(file_path: str) -> str:
+class WorkerState(Enum):
+    STOPPED = "stopped"
+    STARTING = "starting"
+    RUNNING = "running"
+    EXITED = "exited"
+    PARKED = "parked"
+
+
+@dataclass
+class CpuInfo:
+    cpu: int
+    core: int
+    package: int
+    node: int = 0
+    sibling: int = 0
+
+
+@dataclass
+class Topology:
+    cpus: List[CpuInfo]
+    l3_domains: List[Tuple[frozenset, int]] = field(default_factory=list)
+
+    @property
+    def nodes(self) -> List[int]:
+        return sorted({cpu.node for cpu in self.cpus})
+
+    def node_cpus(self, node: int) -> List[CpuInfo]:
+        return [cpu for cpu in self.cpus if cpu.node == node]
+
+    def l3_bytes(self, cpus: List[int]) -> int:
+        wanted = set(cpus)
+        return sum(size for shared, size in self.l3_domains if shared & wanted)
+
+
+@dataclass
+class WorkerPlan:
+    role: str
+    threads: int
+    cpus: List[int] = field(default_factory=list)
+    node: Optional[int] = None
+    api_port: int = 0
+    pin_threads: bool = True
+    huge_pages: bool = True
+
+
+@dataclass
+class ThreadPlan:
+    workers: List[WorkerPlan]
+
+    @property
+    def total_threads(self) -> int:
+        return sum(worker.threads for worker in self.workers)
+
+    def role_threads(self, role: str) -> int:
+        return sum(w.threads for w in self.workers if w.role.split("-")[0] == role)
+
+
+@dataclass
+class Throttle:
+    limit: int
+    threads: int
+    cgroup: Optional[str] = None
+
+    @property
+    def cpu_max(self) -> str:
+        quota = self.limit * self.threads * CPU_MAX_PERIOD // 100
+        return f"{max(quota, 1000)} {CPU_MAX_PERIOD}"
+
+
+@dataclass
+class TelemetrySample:
+    timestamp: float
+    hashrate_10s: Optional[float]
+    hashrate_60s: Optional[float]
+    hashrate_15m: Optional[float]
+    accepted: int
+    rejected: int
+    pool: Optional[str]
+    pool_latency: Optional[int]
+    quota: Optional[int] = None
+
+
+@dataclass
+class PoolEndpoint:
+    url: str
+    latency: Optional[float] = None
+    accepted: float = 0.0
+    rejected: float = 0.0
+
+    @property
+    def reject_ratio(self) -> float:
+        total = self.accepted + self.rejected
+        return self.rejected / total if total else 0.0
+
+    @property
+    def score(self) -> float:
+        if self.latency is None:
+            return float("inf")
+        return self.latency * (1 + POOL_REJECT_WEIGHT * self.reject_ratio)
+
+
+@dataclass
+class WorkerExit:
+    pid: int
+    returncode: int
+    runtime: float
+    ended_at: float
+    reason: Optional[str] = None
+
+
+@dataclass
+class Worker:
+    role: str
+    command: List[str]
+    threads: int
+    cpus: List[int] = field(default_factory=list)
+    node: Optional[int] = None
+    api_port: int = 0
+    throttle: Optional[Throttle] = None
+    state: WorkerState = WorkerState.STOPPED
+    process: Optional[asyncio.subprocess.Process] = None
+    started_at: float = 0.0
+    restarts: int = 0
+    crashes: int = 0
+    stalls: int = 0
+    last_share_at: float = 0.0
+    backoff_until: float = 0.0
+    restart_reason: Optional[str] = None
+    exits: Deque[WorkerExit] = field(
+        default_factory=lambda: deque(maxlen=WORKER_HISTORY_SIZE)
+    )
+    telemetry: Deque[TelemetrySample] = field(
+        default_factory=lambda: deque(maxlen=TELEMETRY_HISTORY_SIZE)
+    )
+
+    @property
+    def active(self) -> bool:
+        return self.state in (WorkerState.STARTING, WorkerState.RUNNING)
+
+
+@dataclass
+class ShareStats:
+    accepted: int = 0
+    rejected: int = 0
+    stale: int = 0
+    job_latency: LatencyHistogram = field(default_factory=LatencyHistogram)
+    submit_latency: LatencyHistogram = field(default_factory=LatencyHistogram)
+
+    @property
+    def total(self) -> int:
+        return self.accepted + self.rejected + self.stale
+
+
+@dataclass
+class ProxyClient:
+    slot: int
+    writer: asyncio.StreamWriter
+    worker: str = ""
+    jobs: Dict[str, float] = field(default_factory=dict)
+
+    @property
+    def session(self) -> str:
+        return f"myne-{self.slot}"
+
+
+@dataclass
+class StratumProxy:
+    clients: Dict[int, ProxyClient] = field(default_factory=dict)
+    pending: Dict[int, Tuple[ProxyClient, object, float]] = field(default_factory=dict)
+    shares: Dict[Tuple[str, str], ShareStats] = field(default_factory=dict)
+    job: Optional[dict] = None
+    job_ready: asyncio.Event = field(default_factory=asyncio.Event)
+    session: Optional[str] = None
+    endpoint: Optional[PoolEndpoint] = None
+    upstream: Optional[asyncio.StreamWriter] = None
+    next_id: int = 2
+
+
+@dataclass
+class Daemon:
+    plan: ThreadPlan
+    workers: Dict[str, Worker]
+    loop_lag: float = 0.0
+    hugepages: Dict[int, Tuple[int, int]] = field(default_factory=dict)
+    pools: List[PoolEndpoint] = field(default_factory=list)
+    proxy: Optional[StratumProxy] = None
+    supervisors: Dict[str, asyncio.Task] = field(default_factory=dict)
+    reload_requested: asyncio.Event = field(default_factory=asyncio.Event)
+
+
+def _hash_file(file_path: str) -> str:
     sha256_hash = hashlib.sha256()
     with open(file_path, "rb") as f:
-        for byte_block in iter(lambda: f.read(4096), b""):
+        for byte_block in iter(lambda: f.read(65536), b""):
             sha256_hash.update(byte_block)
     return sha256_hash.hexdigest()
 
 
+def _write_file(file_path: str, content: str) -> None:
+    with open(file_path, "w") as f:
+        f.write(content)
+
+
+@log_decorator
+async def run_command(command: List[str], check: bool = False) -> Tuple[int, bytes]:
+    process = await asyncio.create_subprocess_exec(
+        *command, stdout=asyncio.subprocess.PIPE
+    )
+    stdout, _ = await process.communicate()
+    if check and process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, command, stdout)
+    return process.returncode, stdout
+
+
+@log_decorator
+async def calculate_file_hash(file_path: str) -> str:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, _hash_file, file_path)
+
+
 @log_decorator
 async def install_self() -> bool:
     try:
@@ -76,7 +528,7 @@ async def install_self() -> bool:
             if current_hash == installed_hash:
                 logging.debug("Script already installed and up to date.")
                 return False
-        subprocess.run(["cp", SCRIPT_PATH, LOCAL_SCRIPT_PATH], check=True)
+        await run_command(["cp", SCRIPT_PATH, LOCAL_SCRIPT_PATH], check=True)
         logging.debug(f"Script copied to {LOCAL_SCRIPT_PATH}")
         service_content = f"""
         [Unit]
@@ -84,17 +536,20 @@ async def install_self() -> bool:
 
         [Service]
         ExecStart=/usr/bin/python3 {LOCAL_SCRIPT_PATH}
+        ExecReload=/bin/kill -HUP $MAINPID
+        Delegate=yes
 
         [Install]
         WantedBy=multi-user.target
         """
         service_path = "/etc/systemd/system/myne.service"
-        with open(service_path, "w") as service_file:
-            service_file.write(service_content)
+        await asyncio.get_running_loop().run_in_executor(
+            None, _write_file, service_path, service_content
+        )
         logging.debug("Systemd service file created/updated.")
-        subprocess.run(["systemctl", "daemon-reload"])
-        subprocess.run(["systemctl", "enable", "myne.service"])
-        subprocess.run(["systemctl", "restart", "myne.service"])
+        await run_command(["systemctl", "daemon-reload"])
+        await run_command(["systemctl", "enable", "myne.service"])
+        await run_command(["systemctl", "restart", "myne.service"])
         logging.debug("Systemd service reloaded and restarted.")
         return True
     except Exception as e:
@@ -104,18 +559,170 @@ async def install_self() -> bool:
 
 @log_decorator
 async def reinstall_self(exec_script_path: str) -> bool:
-    subprocess.run(["cp", exec_script_path, LOCAL_SCRIPT_PATH], check=True)
-    subprocess.run(["systemctl", "restart", "myne.service"], check=True)
+    await run_command(["cp", exec_script_path, LOCAL_SCRIPT_PATH], check=True)
+    await run_command(["systemctl", "restart", "myne.service"], check=True)
     return True
 
 
+def _read_sysfs(path: str) -> Optional[str]:
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def _write_sysfs(path: str, value: str) -> None:
+    with open(path, "w") as f:
+        f.write(value)
+
+
+def _parse_cpu_list(cpu_list: str) -> List[int]:
+    cpus = []
+    for part in cpu_list.split(","):
+        if not part:
+            continue
+        if "-" in part:
+            start, end = part.split("-")
+            cpus.extend(range(int(start), int(end) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+
+def _parse_cache_size(size: str) -> int:
+    units = {"K": 1024, "M": 1024 * 1024, "G": 1024 * 1024 * 1024}
+    if size[-1] in units:
+        return int(size[:-1]) * units[size[-1]]
+    return int(size)
+
+
+def _own_cgroup() -> Optional[str]:
+    try:
+        with open("/proc/self/cgroup") as f:
+            paths = [line.strip()[3:] for line in f if line.startswith("0::")]
+    except OSError:
+        return None
+    return paths[0] if paths else None
+
+
+def _own_cgroup_paths() -> List[str]:
+    path = _own_cgroup()
+    if path is None:
+        return []
+    cgroups = []
+    while True:
+        cgroups.append(os.path.join(CGROUP_ROOT, path.lstrip("/")))
+        if path in ("/", ""):
+            return cgroups
+        path = os.path.dirname(path)
+
+
+def _allowed_cpus() -> set:
+    cpus = set(os.sched_getaffinity(0))
+    for cgroup in _own_cgroup_paths():
+        cpuset = _read_sysfs(os.path.join(cgroup, "cpuset.cpus.effective"))
+        if cpuset:
+            cpus &= set(_parse_cpu_list(cpuset))
+    return cpus
+
+
+def _cgroup_cpu_quota() -> Optional[float]:
+    quotas = []
+    for cgroup in _own_cgroup_paths():
+        cpu_max = _read_sysfs(os.path.join(cgroup, "cpu.max"))
+        if not cpu_max:
+            continue
+        quota, period = cpu_max.split()
+        if quota != "max":
+            quotas.append(int(quota) / int(period))
+    return min(quotas) if quotas else None
+
+
 @log_decorator
 async def get_cpu_cores() -> int:
-    return os.cpu_count()
+    cpus = _allowed_cpus()
+    cpu_cores = len(cpus) or os.cpu_count()
+    quota = _cgroup_cpu_quota()
+    if quota is not None:
+        cpu_cores = min(cpu_cores, max(1, int(quota)))
+    if cpu_cores != os.cpu_count():
+        logging.info(
+            f"\033[93mUsing {cpu_cores} of {os.cpu_count()} CPUs allowed by affinity, "
+            f"cpuset and cgroup quota.\033[0m"
+        )
+    return cpu_cores
 
 
 @log_decorator
-async def calculate_threads_and_limits(cpu_cores: int) -> Tuple[int, int, int]:
+async def read_topology() -> Topology:
+    online = _read_sysfs(os.path.join(SYSFS_CPU_PATH, "online"))
+    if online is None:
+        logging.warning(
+            "\033[93mCPU topology is not available, assuming a flat layout.\033[0m"
+        )
+        return Topology(
+            cpus=[CpuInfo(cpu=i, core=i, package=0) for i in sorted(_allowed_cpus())]
+        )
+
+    cpu_nodes = {}
+    for node_path in glob.glob(os.path.join(SYSFS_NODE_PATH, "node[0-9]*")):
+        node_cpus = _read_sysfs(os.path.join(node_path, "cpulist"))
+        for cpu in _parse_cpu_list(node_cpus or ""):
+            cpu_nodes[cpu] = int(os.path.basename(node_path)[4:])
+
+    cpus = []
+    l3_domains = {}
+    allowed = _allowed_cpus()
+    for cpu in _parse_cpu_list(online):
+        if allowed and cpu not in allowed:
+            continue
+        cpu_path = os.path.join(SYSFS_CPU_PATH, f"cpu{cpu}")
+        core = _read_sysfs(os.path.join(cpu_path, "topology", "core_id"))
+        package = _read_sysfs(os.path.join(cpu_path, "topology", "physical_package_id"))
+        cpus.append(
+            CpuInfo(
+                cpu=cpu,
+                core=int(core) if core is not None else cpu,
+                package=int(package) if package is not None else 0,
+                node=cpu_nodes.get(cpu, 0),
+            )
+        )
+        for cache_path in glob.glob(os.path.join(cpu_path, "cache", "index[0-9]*")):
+            if _read_sysfs(os.path.join(cache_path, "level")) != "3":
+                continue
+            shared = _read_sysfs(os.path.join(cache_path, "shared_cpu_list"))
+            size = _read_sysfs(os.path.join(cache_path, "size"))
+            if shared and size:
+                l3_domains[frozenset(_parse_cpu_list(shared))] = _parse_cache_size(size)
+
+    siblings = {}
+    for info in cpus:
+        key = (info.package, info.core)
+        info.sibling = siblings.get(key, 0)
+        siblings[key] = info.sibling + 1
+    return Topology(cpus=cpus, l3_domains=list(l3_domains.items()))
+
+
+def _take_cpu(
+    topology: Topology, reserved: set, spare: List[CpuInfo]
+) -> Optional[CpuInfo]:
+    # Idle siblings of reserved cores first, then the last hyperthread.
+    candidates = [info for info in topology.cpus if info.cpu not in reserved]
+    if spare:
+        info = spare.pop(0)
+    elif candidates:
+        info = max(candidates, key=lambda info: (info.sibling, info.node, info.cpu))
+    else:
+        return None
+    reserved.add(info.cpu)
+    return info
+
+
+@log_decorator
+async def calculate_threads_and_limits(
+    cpu_cores: int, topology: Topology
+) -> ThreadPlan:
     if cpu_cores >= CPU_LIMIT_THRESHOLD:
         main_threads = cpu_cores - 2
         limited_threads = 1
@@ -124,92 +731,2359 @@ async def calculate_threads_and_limits(cpu_cores: int) -> Tuple[int, int, int]:
         main_threads = cpu_cores - 1
         limited_threads = 1
         free_threads = 0
-    return main_threads, limited_threads, free_threads
+
+    # The free worker gets whole physical cores, taken from the end of the
+    # last node, so it never shares a core with main. The limited worker runs
+    # one throttled thread and only takes a logical CPU, preferably an idle
+    # sibling of a free core, so main keeps every other CPU.
+    cores = {}
+    for info in topology.cpus:
+        cores.setdefault((info.node, info.package, info.core), []).append(info)
+    whole_cores = list(cores.values())[::-1]
+    reserved = set()
+    spare = []
+    free_cpus = []
+    while whole_cores and len(free_cpus) < free_threads:
+        core = whole_cores.pop(0)
+        left = len(topology.cpus) - len(reserved) - len(core)
+        siblings = len(spare) + len(core) - 1
+        if main_threads > 0 and left < 1 + max(limited_threads - siblings, 0):
+            break
+        reserved.update(info.cpu for info in core)
+        free_cpus.append(core[0])
+        spare.extend(core[1:])
+    while len(free_cpus) < free_threads:
+        info = _take_cpu(topology, reserved, spare)
+        if info is None:
+            break
+        free_cpus.append(info)
+    limited_cpus = []
+    while len(limited_cpus) < limited_threads:
+        info = _take_cpu(topology, reserved, spare)
+        if info is None:
+            break
+        limited_cpus.append(info)
+    reserved_workers = [
+        WorkerPlan(
+            role=role,
+            threads=threads,
+            cpus=[info.cpu for info in role_cpus],
+            node=role_cpus[0].node if role_cpus else None,
+        )
+        for role, threads, role_cpus in (
+            ("limited", limited_threads, limited_cpus),
+            ("free", free_threads, free_cpus),
+        )
+        if threads > 0
+    ]
+
+    node_cpus = {}
+    node_caps = {}
+    for node in topology.nodes:
+        available = sorted(
+            (info for info in topology.node_cpus(node) if info.cpu not in reserved),
+            key=lambda info: (info.sibling, info.cpu),
+        )
+        node_cpus[node] = [info.cpu for info in available]
+        node_caps[node] = len(available)
+        l3_bytes = topology.l3_bytes(node_cpus[node])
+        if l3_bytes:
+            node_caps[node] = min(
+                node_caps[node], max(l3_bytes // RANDOMX_SCRATCHPAD, 1)
+            )
+
+    node_threads = {node: 0 for node in topology.nodes}
+    for _ in range(max(main_threads, 0)):
+        node = max(node_threads, key=lambda n: node_caps[n] - node_threads[n])
+        if node_threads[node] >= node_caps[node]:
+            logging.info(
+                f"\033[93mOnly {sum(node_threads.values())} of {main_threads} main threads "
+                f"fit the available cores and L3 cache.\033[0m"
+            )
+            break
+        node_threads[node] += 1
+
+    main_nodes = [node for node in topology.nodes if node_threads[node] > 0]
+    main_workers = [
+        WorkerPlan(
+            role="main" if len(main_nodes) == 1 else f"main-node{node}",
+            threads=node_threads[node],
+            cpus=node_cpus[node][: node_threads[node]],
+            node=node,
+        )
+        for node in main_nodes
+    ]
+    workers = main_workers + reserved_workers
+    for index, worker in enumerate(workers):
+        worker.api_port = API_PORT_BASE + index
+    return ThreadPlan(workers=workers)
+
+
+def _write_json_atomic(path: str, data: dict) -> None:
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def create_xmrig_config(
+    worker: WorkerPlan, cuda: bool, numa: bool, pools: Optional[List[str]] = None
+) -> dict:
+    affinity = list(worker.cpus[: worker.threads]) if worker.pin_threads else []
+    affinity += [-1] * (worker.threads - len(affinity))
+    return {
+        "autosave": False,
+        "background": False,
+        "colors": False,
+        "watch": True,
+        "http": {
+            "enabled": True,
+            "host": API_HOST,
+            "port": worker.api_port,
+            "restricted": True,
+        },
+        "randomx": {
+            "mode": RANDOMX_MODE,
+            "1gb-pages": HUGEPAGE_SIZE_KB == 1024 * 1024,
+            "numa": numa,
+        },
+        "cpu": {
+            "enabled": True,
+            "huge-pages": worker.huge_pages,
+            "rx": affinity,
+        },
+        "cuda": {"enabled": cuda},
+        "opencl": {"enabled": False},
+        "pools": (
+            [
+                {
+                    "url": f"{PROXY_HOST}:{PROXY_PORT}",
+                    "nicehash": True,
+                    "keepalive": True,
+                    "rig-id": worker.role,
+                }
+            ]
+            if STRATUM_PROXY
+            else [{"url": url, "keepalive": True} for url in pools or POOL_HOSTS]
+        ),
+    }
 
 
 @log_decorator
 async def create_xmrig_commands(
-    main_threads: int, limited_threads: int, free_threads: int
-) -> List[str]:
-    commands = []
-    if main_threads > 0:
-        commands.append(
-            f"{XMRIG_PATH} -o {DEFAULT_HOST} --threads={main_threads} --cuda"
-        )
-    if limited_threads > 0:
-        commands.append(
-            f"{CPULIMIT_PATH} -c 1 -l {CPU_LIMIT_LOW} -- {XMRIG_PATH} -o {DEFAULT_HOST} --threads=1"
-        )
-    if free_threads > 0:
-        commands.append(f"{XMRIG_PATH} -o {DEFAULT_HOST} --threads=1")
+    plan: ThreadPlan, pools: Optional[List[str]] = None
+) -> Dict[str, List[str]]:
+    commands = {}
+    main_workers = [w for w in plan.workers if w.role.startswith("main")]
+    loop = asyncio.get_running_loop()
+    for worker in plan.workers:
+        config = create_xmrig_config(
+            worker,
+            cuda=bool(main_workers) and worker is main_workers[0],
+            # One worker per node already keeps its dataset local.
+            numa=len(main_workers) <= 1,
+            pools=pools,
+        )
+        config_path = os.path.join(XMRIG_CONFIG_DIR, f"{worker.role}.json")
+        # Rewriting an unchanged file would still make xmrig reload it.
+        if await loop.run_in_executor(None, _read_json, config_path) != config:
+            await loop.run_in_executor(None, _write_json_atomic, config_path, config)
+        commands[worker.role] = [XMRIG_PATH, f"--config={config_path}"]
     return commands
 
 
+def _hugepages_path(node: Optional[int]) -> str:
+    size_dir = f"hugepages-{HUGEPAGE_SIZE_KB}kB"
+    if node is None:
+        return os.path.join(HUGEPAGES_PATH, size_dir)
+    return os.path.join(SYSFS_NODE_PATH, f"node{node}", "hugepages", size_dir)
+
+
+hugepages_baseline: Dict[str, int] = {}
+
+
+def _save_hugepages(held: Dict[str, int]) -> None:
+    try:
+        _write_json_atomic(HUGEPAGES_STATE_PATH, held)
+    except OSError as e:
+        logging.warning(
+            f"\033[93mCould not record reserved huge pages in {HUGEPAGES_STATE_PATH}: {e}\033[0m"
+        )
+
+
+def _held_hugepages() -> Dict[str, int]:
+    held = _read_json(HUGEPAGES_STATE_PATH) or {}
+    return {
+        path: pages
+        for path, pages in held.items()
+        if isinstance(path, str) and isinstance(pages, int) and pages > 0
+    }
+
+
+def _reserve_hugepages(node: Optional[int], pages: int) -> int:
+    path = os.path.join(_hugepages_path(node), "nr_hugepages")
+    current = int(_read_sysfs(path) or 0)
+    held = _held_hugepages()
+    # Pages the host had reserved before we started belong to someone else;
+    # ours go on top and the count we report excludes them. Pages left over
+    # by a previous run that did not get to release them are still ours.
+    if path not in hugepages_baseline:
+        hugepages_baseline[path] = max(current - held.get(path, 0), 0)
+    baseline = hugepages_baseline[path]
+    if current != baseline + pages:
+        try:
+            _write_sysfs(path, str(baseline + pages))
+        except OSError as e:
+            logging.warning(
+                f"\033[93mCould not reserve {pages} huge pages on node {node}: {e}\033[0m"
+            )
+    achieved = int(_read_sysfs(path) or 0) - baseline
+    if held.get(path, 0) != max(achieved, 0):
+        held[path] = max(achieved, 0)
+        _save_hugepages(held)
+    return achieved
+
+
+def release_hugepages(paths: Optional[List[str]] = None) -> None:
+    paths = list(hugepages_baseline if paths is None else paths)
+    if not paths:
+        return
+    held = _held_hugepages()
+    for path in paths:
+        pages = hugepages_baseline.pop(path)
+        try:
+            _write_sysfs(path, str(pages))
+            held.pop(path, None)
+        except OSError as e:
+            logging.warning(
+                f"\033[93mCould not release huge pages in {path}: {e}\033[0m"
+            )
+    _save_hugepages(held)
+
+
+def _meminfo() -> Dict[str, int]:
+    info = {}
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                name, _, value = line.partition(":")
+                info[name] = int(value.split()[0])
+    except (OSError, ValueError, IndexError):
+        pass
+    return info
+
+
+def _hugepage_demand(plan: ThreadPlan) -> Dict[int, int]:
+    page_bytes = HUGEPAGE_SIZE_KB * 1024
+    memory = RANDOMX_CACHE_BYTES
+    if RANDOMX_MODE == "fast":
+        memory += RANDOMX_DATASET_BYTES
+    demand = {}
+    for worker in plan.workers:
+        if not worker.huge_pages:
+            continue
+        pages = -(-memory // page_bytes) + -(
+            -worker.threads * RANDOMX_SCRATCHPAD // page_bytes
+        )
+        node = worker.node or 0
+        demand[node] = demand.get(node, 0) + pages
+    return demand
+
+
+@log_decorator
+async def prepare_hugepages(plan: ThreadPlan) -> Dict[int, Tuple[int, int]]:
+    demand = _hugepage_demand(plan)
+    per_node = all(os.path.isdir(_hugepages_path(node)) for node in demand)
+    if not per_node:
+        demand = {0: sum(demand.values())}
+
+    # Leave the rest of memory to the services we share the host with;
+    # pages we already hold do not show up in MemAvailable.
+    meminfo = _meminfo()
+    if "MemAvailable" in meminfo:
+        ours = sum(
+            int(_read_sysfs(path) or 0) - baseline
+            for path, baseline in hugepages_baseline.items()
+        )
+        available = meminfo["MemAvailable"] + max(ours, 0) * HUGEPAGE_SIZE_KB
+        limit = int(available * HUGEPAGES_MEMORY_FRACTION) // HUGEPAGE_SIZE_KB
+        wanted = sum(demand.values())
+        if wanted > limit:
+            logging.warning(
+                f"\033[93mCapping huge pages at {limit} of {wanted} wanted, "
+                f"{HUGEPAGES_MEMORY_FRACTION:.0%} of available memory.\033[0m"
+            )
+            demand = {node: pages * limit // wanted for node, pages in demand.items()}
+
+    loop = asyncio.get_running_loop()
+    result = {}
+    for node, pages in sorted(demand.items()):
+        sysfs_node = node if per_node else None
+        achieved = await loop.run_in_executor(
+            None, _reserve_hugepages, sysfs_node, pages
+        )
+        if achieved < pages:
+            # Fragmented memory is the usual cause; compact once and retry.
+            try:
+                await loop.run_in_executor(
+                    None, _write_sysfs, "/proc/sys/vm/compact_memory", "1"
+                )
+            except OSError:
+                pass
+            achieved = await loop.run_in_executor(
+                None, _reserve_hugepages, sysfs_node, pages
+            )
+        result[node] = (pages, achieved)
+        if achieved < pages:
+            logging.error(
+                f"\033[91mOnly {achieved} of {pages} {HUGEPAGE_SIZE_KB} kB huge pages reserved on node {node}; "
+                f"workers there will fall back to regular pages.\033[0m"
+            )
+        else:
+            logging.info(
+                f"\033[92mReserved {achieved} {HUGEPAGE_SIZE_KB} kB huge pages on node {node} "
+                f"({pages} needed).\033[0m"
+            )
+    reserved = {
+        os.path.join(_hugepages_path(node if per_node else None), "nr_hugepages")
+        for node in demand
+    }
+    unused = [path for path in hugepages_baseline if path not in reserved]
+    if unused:
+        await loop.run_in_executor(None, release_hugepages, unused)
+    return result
+
+
+@log_decorator
+async def prepare_msr() -> bool:
+    if os.path.exists("/dev/cpu/0/msr"):
+        return True
+    try:
+        returncode, _ = await run_command(["modprobe", "msr"])
+    except OSError as e:
+        logging.warning(f"\033[93mCould not load the msr module: {e}\033[0m")
+        return False
+    if returncode != 0:
+        logging.warning(
+            "\033[93mCould not load the msr module, xmrig will run without MSR tweaks.\033[0m"
+        )
+    return returncode == 0
+
+
+def _write_cgroup_file(cgroup: str, name: str, value: str) -> None:
+    _write_sysfs(os.path.join(cgroup, name), value)
+
+
+@log_decorator
+async def setup_throttle_cgroup() -> Optional[str]:
+    try:
+        path = _own_cgroup()
+        if path is None or not os.path.exists(
+            os.path.join(CGROUP_ROOT, "cgroup.controllers")
+        ):
+            logging.warning("\033[93mcgroup v2 is not available.\033[0m")
+            return None
+        if path == "/":
+            _write_cgroup_file(CGROUP_ROOT, "cgroup.subtree_control", "+cpu")
+            base = os.path.join(CGROUP_ROOT, "myne")
+            os.makedirs(base, exist_ok=True)
+        else:
+            # Processes may only live in leaf cgroups once controllers are
+            # enabled for children, so move the daemon into its own leaf.
+            base = os.path.join(CGROUP_ROOT, path.lstrip("/"))
+            daemon_cgroup = os.path.join(base, "daemon")
+            os.makedirs(daemon_cgroup, exist_ok=True)
+            _write_cgroup_file(daemon_cgroup, "cgroup.procs", str(os.getpid()))
+        _write_cgroup_file(base, "cgroup.subtree_control", "+cpu")
+        limited_cgroup = os.path.join(base, "limited")
+        os.makedirs(limited_cgroup, exist_ok=True)
+        return limited_cgroup
+    except OSError as e:
+        logging.warning(f"\033[93mCould not set up throttling cgroup: {e}\033[0m")
+        return None
+
+
+@log_decorator
+async def apply_throttle(throttle: Throttle) -> bool:
+    if throttle.cgroup is None:
+        return False
+    try:
+        _write_cgroup_file(throttle.cgroup, "cpu.max", throttle.cpu_max)
+        return True
+    except OSError as e:
+        logging.warning(
+            f"\033[93mCould not write cpu.max for {throttle.cgroup}: {e}\033[0m"
+        )
+        return False
+
+
+@log_decorator
+async def create_throttle(limit: int, threads: int) -> Throttle:
+    throttle = Throttle(limit=limit, threads=threads)
+    throttle.cgroup = await setup_throttle_cgroup()
+    if await apply_throttle(throttle):
+        logging.info(
+            f"\033[92mThrottling limited worker with cgroup cpu.max {throttle.cpu_max}\033[0m"
+        )
+    else:
+        throttle.cgroup = None
+        logging.warning(
+            f"\033[93mFalling back to niceness {LIMITED_NICENESS} for the limited worker.\033[0m"
+        )
+    return throttle
+
+
+def _read_host_cpu_times() -> Tuple[int, int]:
+    with open("/proc/stat") as f:
+        fields = [int(value) for value in f.readline().split()[1:]]
+    idle = fields[3] + (fields[4] if len(fields) > 4 else 0)
+    return sum(fields), sum(fields) - idle
+
+
+def _read_process_cpu_time(pid: int) -> Optional[int]:
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+    except OSError:
+        return None
+    return int(fields[11]) + int(fields[12])
+
+
+@log_decorator
+async def adapt_throttle(workers: Dict[str, Worker]) -> None:
+    # Looks the limited worker up every round, so workers added or
+    # re-created by a reload are picked up.
+    cpu_count = os.cpu_count()
+    previous_host = _read_host_cpu_times()
+    previous_workers = {}
+    throttle = None
+    target = 0.0
+    warned = False
+    while True:
+        await asyncio.sleep(THROTTLE_INTERVAL)
+        limited = workers.get("limited")
+        host = _read_host_cpu_times()
+        total = host[0] - previous_host[0]
+        busy = host[1] - previous_host[1]
+        previous_host = host
+        ours = 0
+        limited_usage = 0
+        current_workers = {}
+        for worker in workers.values():
+            if worker.process is None or worker.process.returncode is not None:
+                continue
+            pid = worker.process.pid
+            cpu_time = _read_process_cpu_time(pid)
+            if cpu_time is None:
+                continue
+            current_workers[pid] = cpu_time
+            used = cpu_time - previous_workers.get(pid, 0)
+            ours += used
+            if worker is limited:
+                limited_usage = used
+        previous_workers = current_workers
+        if total <= 0 or limited is None or limited.throttle is None:
+            continue
+        if limited.throttle.cgroup is None:
+            if not warned:
+                logging.info(
+                    "\033[93mNo cpu cgroup for the limited worker, adaptive throttling is off.\033[0m"
+                )
+                warned = True
+            continue
+        if limited.throttle is not throttle:
+            throttle = limited.throttle
+            target = float(throttle.limit)
+
+        # Fractions of the whole host; the limited worker may take whatever
+        # keeps everybody, including our other workers, under USAGE_LIMIT.
+        others = max(busy - ours, 0) / total
+        our_rest = (ours - limited_usage) / total
+        allowed = (USAGE_LIMIT - others - our_rest) * cpu_count
+        wanted = allowed / max(limited.threads, 1) * 100
+        wanted = min(max(wanted, CPU_LIMIT_LOW), CPU_LIMIT_HIGH)
+        target += THROTTLE_SMOOTHING * (wanted - target)
+        limit = int(round(target))
+        at_bound = limit in (CPU_LIMIT_LOW, CPU_LIMIT_HIGH)
+        if abs(limit - throttle.limit) < THROTTLE_HYSTERESIS and not (
+            at_bound and limit != throttle.limit
+        ):
+            continue
+        logging.info(
+            f"\033[93mHost usage by others is {others:.0%}, moving the limited worker "
+            f"from {throttle.limit}% to {limit}% per thread.\033[0m"
+        )
+        throttle.limit = limit
+        await apply_throttle(throttle)
+
+
+# Applied by a fresh single-threaded interpreter that then execs xmrig, so
+# no fork ever happens with the daemon's own threads in an unknown state.
+WORKER_LAUNCHER = """
+import ctypes, json, os, sys
+spec = json.loads(sys.argv[1])
+if spec["cpus"]:
+    try:
+        os.sched_setaffinity(0, spec["cpus"])
+    except OSError:
+        pass
+if spec["mempolicy"] is not None:
+    syscall, mode, node = spec["mempolicy"]
+    words = node // 64 + 1
+    nodemask = (ctypes.c_ulong * words)()
+    nodemask[node // 64] = 1 << (node % 64)
+    ctypes.CDLL(None).syscall(syscall, mode, nodemask, ctypes.c_ulong(words * 64 + 1))
+if spec["idle"]:
+    os.sched_setscheduler(0, os.SCHED_IDLE, os.sched_param(0))
+if spec["cgroup"] is not None:
+    with open(os.path.join(spec["cgroup"], "cgroup.procs"), "w") as f:
+        f.write("0")
+if spec["niceness"] is not None:
+    os.setpriority(os.PRIO_PROCESS, 0, spec["niceness"])
+os.execv(sys.argv[2], sys.argv[2:])
+"""
+
+
+def _worker_command(worker: Worker, command: List[str]) -> List[str]:
+    syscall = SET_MEMPOLICY_SYSCALLS.get(platform.machine())
+    throttle = worker.throttle
+    spec = {
+        "cpus": worker.cpus,
+        "mempolicy": (
+            [syscall, MPOL_PREFERRED, worker.node]
+            if worker.node is not None and syscall is not None
+            else None
+        ),
+        # Free cores belong to the host; only use them when nothing else
+        # wants to run there.
+        "idle": worker.role == "free",
+        "cgroup": throttle.cgroup if throttle is not None else None,
+        "niceness": (
+            LIMITED_NICENESS
+            if throttle is not None and throttle.cgroup is None
+            else None
+        ),
+    }
+    return [
+        sys.executable,
+        "-I",
+        "-S",
+        "-c",
+        WORKER_LAUNCHER,
+        json.dumps(spec),
+    ] + command
+
+
+def _update_worker(worker: Worker, plan: WorkerPlan) -> None:
+    worker.threads = plan.threads
+    worker.cpus = plan.cpus
+    worker.node = plan.node
+    worker.api_port = plan.api_port
+
+
+@log_decorator
+async def create_worker_table(
+    plan: ThreadPlan, pools: Optional[List[str]] = None
+) -> Dict[str, Worker]:
+    commands = await create_xmrig_commands(plan, pools)
+    workers = {
+        worker.role: Worker(role=worker.role, command=commands[worker.role], threads=0)
+        for worker in plan.workers
+    }
+    for worker in plan.workers:
+        _update_worker(workers[worker.role], worker)
+    if "limited" in workers:
+        workers["limited"].throttle = await create_throttle(
+            CPU_LIMIT_LOW, workers["limited"].threads
+        )
+    return workers
+
+
 @log_decorator
 async def check_xmrig_running() -> bool:
-    result = subprocess.run(PGREP_CMD, stdout=subprocess.PIPE)
-    return result.returncode == 0
+    returncode, _ = await run_command(PGREP_CMD)
+    return returncode == 0
 
 
 @log_decorator
 async def kill_xmrig() -> None:
-    result = subprocess.run(PGREP_CMD, stdout=subprocess.PIPE)
-    if result.returncode == 0:
-        pids = result.stdout.decode().split()
+    returncode, stdout = await run_command(PGREP_CMD)
+    if returncode == 0:
+        pids = stdout.decode().split()
         for pid in pids:
-            subprocess.run(["kill", "-9", pid], check=True)
+            try:
+                os.kill(int(pid), signal.SIGKILL)
+            except ProcessLookupError:
+                continue
             logging.info(f"\033[93mKilled xmrig process with PID: {pid}\033[0m")
 
 
 @log_decorator
-async def run_xmrig_command(command: str) -> int:
-    process = subprocess.Popen(command, shell=True)
-    return process.pid
+async def run_xmrig_command(command: List[str]) -> asyncio.subprocess.Process:
+    return await asyncio.create_subprocess_exec(*command)
 
 
 @log_decorator
-async def main():
+async def start_worker(
+    worker: Worker, workers: Dict[str, Worker], planned_threads: int
+) -> bool:
+    if worker.active:
+        logging.warning(
+            f"\033[93mWorker {worker.role} is already {worker.state.value}, not starting it again.\033[0m"
+        )
+        return False
+    active_threads = sum(w.threads for w in workers.values() if w.active)
+    if active_threads + worker.threads > planned_threads:
+        logging.error(
+            f"\033[91mStarting worker {worker.role} would run {active_threads + worker.threads} threads, "
+            f"more than the {planned_threads} planned.\033[0m"
+        )
+        return False
+    worker.state = WorkerState.STARTING
     try:
-        if await install_self():
+        worker.process = await run_xmrig_command(
+            _worker_command(worker, worker.command)
+        )
+    except Exception:
+        worker.process = None
+        worker.state = WorkerState.EXITED
+        raise
+    worker.started_at = time.monotonic()
+    worker.last_share_at = worker.started_at
+    worker.state = WorkerState.RUNNING
+    logging.info(
+        f"\033[92mStarted xmrig worker {worker.role} with PID: {worker.process.pid}\033[0m",
+        extra={
+            "worker": worker.role,
+            "pid": worker.process.pid,
+            "threads": worker.threads,
+        },
+    )
+    return True
+
+
+def _backoff_delay(base: float, attempt: int, maximum: float) -> float:
+    delay = min(base * 2 ** max(attempt - 1, 0), maximum)
+    return delay * random.uniform(1 - RESTART_JITTER, 1 + RESTART_JITTER)
+
+
+def _pool_address(url: str) -> Tuple[str, int]:
+    host, _, port = url.split("://", 1)[-1].rstrip("/").rpartition(":")
+    return host, int(port)
+
+
+async def probe_pool(url: str) -> Optional[float]:
+    host, port = _pool_address(url)
+    started = time.monotonic()
+    try:
+        _, writer = await asyncio.wait_for(
+            asyncio.open_connection(host, port), POOL_PROBE_TIMEOUT
+        )
+    except (OSError, asyncio.TimeoutError):
+        return None
+    latency = time.monotonic() - started
+    writer.close()
+    return latency
+
+
+async def _recovery_conditions() -> Tuple[Optional[Tuple[int, int]], bool]:
+    try:
+        stat = os.stat(XMRIG_PATH)
+        binary = (stat.st_mtime_ns, stat.st_size)
+    except OSError:
+        binary = None
+    latencies = await asyncio.gather(*(probe_pool(url) for url in POOL_HOSTS))
+    pool_reachable = any(latency is not None for latency in latencies)
+    return binary, pool_reachable
+
+
+@log_decorator
+async def park_worker(worker: Worker) -> None:
+    worker.state = WorkerState.PARKED
+    last_exit = worker.exits[-1] if worker.exits else None
+    logging.error(
+        f"\033[91mxmrig worker {worker.role} failed {worker.crashes} times in a row"
+        f"{f' (last exit code {last_exit.returncode} after {last_exit.runtime:.1f}s)' if last_exit else ''}; "
+        f"parking it until {XMRIG_PATH} or pool reachability changes, "
+        f"or for at most {PARKED_RETRY_INTERVAL}s.\033[0m",
+        extra={"worker": worker.role, "reason": "crash loop"},
+    )
+    conditions = await _recovery_conditions()
+    parked_at = time.monotonic()
+    while True:
+        await asyncio.sleep(PARKED_CHECK_INTERVAL)
+        if await _recovery_conditions() != conditions:
+            reason = "xmrig binary or pool reachability changed"
+            break
+        if time.monotonic() - parked_at >= PARKED_RETRY_INTERVAL:
+            reason = "retry interval elapsed"
+            break
+    logging.info(
+        f"\033[93mUnparking xmrig worker {worker.role}: {reason}\033[0m",
+        extra={"worker": worker.role, "reason": reason},
+    )
+    # A single further failure parks the worker again.
+    worker.crashes = CRASH_LOOP_THRESHOLD - 1
+    worker.state = WorkerState.EXITED
+
+
+async def rebalance_hugepages(daemon: Daemon) -> None:
+    plan = ThreadPlan(
+        workers=[
+            worker
+            for worker in daemon.plan.workers
+            if daemon.workers[worker.role].state != WorkerState.PARKED
+        ]
+    )
+    daemon.hugepages = await prepare_hugepages(plan)
+
+
+@log_decorator
+async def supervise_worker(worker: Worker, daemon: Daemon) -> None:
+    while True:
+        worker_exit = None
+        try:
+            if not await start_worker(
+                worker, daemon.workers, daemon.plan.total_threads
+            ):
+                return
+        except OSError as e:
+            worker.crashes += 1
+            logging.error(
+                f"\033[91mCould not start xmrig worker {worker.role}: {e}\033[0m",
+                extra={"worker": worker.role, "reason": str(e)},
+            )
+        else:
+            worker_exit = await reap_worker(worker)
+            worker.restarts += 1
+            if worker_exit.reason is not None:
+                worker.stalls += 1
+            elif worker_exit.runtime < HEALTHY_RUNTIME:
+                worker.crashes += 1
+            else:
+                worker.crashes = 0
+
+        if worker.crashes >= CRASH_LOOP_THRESHOLD:
+            # Hand a parked worker's huge pages back to the host meanwhile.
+            worker.state = WorkerState.PARKED
+            await rebalance_hugepages(daemon)
+            await park_worker(worker)
+            await rebalance_hugepages(daemon)
+            continue
+        if worker_exit is not None and worker_exit.reason is not None:
+            delay = _backoff_delay(STALL_BACKOFF_BASE, worker.stalls, STALL_BACKOFF_MAX)
+        elif worker.crashes:
+            delay = _backoff_delay(
+                RESTART_BACKOFF_BASE, worker.crashes, RESTART_BACKOFF_MAX
+            )
+        else:
+            delay = RESTART_DELAY
+        worker.backoff_until = time.monotonic() + delay
+        if worker_exit is not None:
+            logging.error(
+                f"\033[91mxmrig worker {worker.role} with PID {worker_exit.pid} exited with code "
+                f"{worker_exit.returncode} after {worker_exit.runtime:.1f}s"
+                f"{f' ({worker_exit.reason})' if worker_exit.reason else ''}, restarting in {delay:.1f}s...\033[0m",
+                extra={
+                    "worker": worker.role,
+                    "pid": worker_exit.pid,
+                    "returncode": worker_exit.returncode,
+                    "reason": worker_exit.reason,
+                    "duration": worker_exit.runtime,
+                },
+            )
+        await asyncio.sleep(delay)
+
+
+@log_decorator
+async def reap_worker(worker: Worker) -> WorkerExit:
+    returncode = await worker.process.wait()
+    worker_exit = WorkerExit(
+        pid=worker.process.pid,
+        returncode=returncode,
+        runtime=time.monotonic() - worker.started_at,
+        ended_at=time.time(),
+        reason=worker.restart_reason,
+    )
+    worker.restart_reason = None
+    worker.exits.append(worker_exit)
+    worker.state = WorkerState.EXITED
+    return worker_exit
+
+
+@log_decorator
+async def restart_worker(worker: Worker, reason: str) -> None:
+    if worker.process is None or worker.process.returncode is not None:
+        return
+    logging.warning(
+        f"\033[93mRestarting xmrig worker {worker.role} with PID {worker.process.pid}: {reason}\033[0m",
+        extra={"worker": worker.role, "pid": worker.process.pid, "reason": reason},
+    )
+    worker.restart_reason = reason
+    worker.process.terminate()
+    try:
+        await asyncio.wait_for(asyncio.shield(worker.process.wait()), STOP_TIMEOUT)
+    except asyncio.TimeoutError:
+        worker.process.kill()
+
+
+@log_decorator
+async def stop_worker(worker: Worker) -> None:
+    if worker.process is not None and worker.process.returncode is None:
+        worker.process.terminate()
+        try:
+            await asyncio.wait_for(worker.process.wait(), STOP_TIMEOUT)
+        except asyncio.TimeoutError:
+            worker.process.kill()
+        worker_exit = await reap_worker(worker)
+        logging.info(
+            f"\033[93mStopped xmrig worker {worker.role} with PID {worker_exit.pid} "
+            f"after {worker_exit.runtime:.1f}s, exit code {worker_exit.returncode}\033[0m",
+            extra={
+                "worker": worker.role,
+                "pid": worker_exit.pid,
+                "returncode": worker_exit.returncode,
+                "duration": worker_exit.runtime,
+            },
+        )
+    worker.state = WorkerState.STOPPED
+
+
+@log_decorator
+async def stop_workers(workers: Dict[str, Worker]) -> None:
+    await asyncio.gather(*(stop_worker(worker) for worker in workers.values()))
+
+
+async def _http_get_json(host: str, port: int, path: str) -> dict:
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        writer.write(
+            f"GET {path} HTTP/1.0\r\nHost: {host}\r\nAccept: application/json\r\n\r\n".encode()
+        )
+        await writer.drain()
+        response = await reader.read()
+    finally:
+        writer.close()
+    head, _, body = response.partition(b"\r\n\r\n")
+    status = head.split(b"\r\n", 1)[0].split()
+    if len(status) < 2 or status[1] != b"200":
+        raise ConnectionError(f"HTTP {head[:64]!r} from {host}:{port}{path}")
+    return json.loads(body)
+
+
+@log_decorator
+async def fetch_worker_telemetry(worker: Worker) -> Optional[TelemetrySample]:
+    try:
+        summary = await asyncio.wait_for(
+            _http_get_json(API_HOST, worker.api_port, "/1/summary"),
+            TELEMETRY_TIMEOUT,
+        )
+    except (OSError, asyncio.TimeoutError, ValueError) as e:
+        logging.warning(
+            f"\033[93mCould not read telemetry from worker {worker.role}: {e}\033[0m"
+        )
+        return None
+    hashrate = (summary.get("hashrate", {}).get("total") or []) + [None] * 3
+    results = summary.get("results", {})
+    connection = summary.get("connection", {})
+    accepted = results.get("shares_good", 0)
+    if not worker.telemetry or accepted > worker.telemetry[-1].accepted:
+        worker.last_share_at = time.monotonic()
+    sample = TelemetrySample(
+        timestamp=time.time(),
+        hashrate_10s=hashrate[0],
+        hashrate_60s=hashrate[1],
+        hashrate_15m=hashrate[2],
+        accepted=accepted,
+        rejected=results.get("shares_total", accepted) - accepted,
+        pool=connection.get("pool"),
+        pool_latency=connection.get("ping"),
+        quota=worker.throttle.limit if worker.throttle is not None else None,
+    )
+    worker.telemetry.append(sample)
+    return sample
+
+
+def _stall_reason(worker: Worker) -> Optional[str]:
+    now = time.monotonic()
+    if now - worker.started_at < STALL_GRACE_PERIOD or not worker.telemetry:
+        return None
+    if now - worker.last_share_at > STALL_SHARE_TIMEOUT:
+        return f"no accepted shares for {now - worker.last_share_at:.0f}s"
+    if worker.role == "free":
+        # SCHED_IDLE threads only get what the host leaves over, so their
+        # hashrate says nothing about xmrig's health.
+        worker.stalls = 0
+        return None
+    # Compare hashrate per unit of CPU quota so that adaptive throttling is
+    # not mistaken for a stall.
+    latest = worker.telemetry[-1]
+    current = latest.hashrate_60s
+    window = [
+        sample.hashrate_60s * 100 / (sample.quota or 100)
+        for sample in worker.telemetry
+        if sample.hashrate_60s is not None
+        and sample.timestamp > time.time() - STALL_BASELINE_WINDOW
+    ]
+    if current is None or not window:
+        return None
+    baseline = sorted(window)[len(window) // 2] * (latest.quota or 100) / 100
+    if current < baseline * STALL_HASHRATE_FRACTION:
+        return f"hashrate {current:.1f} H/s is below {STALL_HASHRATE_FRACTION:.0%} of its {baseline:.1f} H/s baseline"
+    worker.stalls = 0
+    return None
+
+
+@log_decorator
+async def collect_telemetry(workers: Dict[str, Worker]) -> None:
+    last_logged = time.monotonic()
+    while True:
+        await asyncio.sleep(TELEMETRY_INTERVAL)
+        running = [w for w in workers.values() if w.state == WorkerState.RUNNING]
+        await asyncio.gather(*(fetch_worker_telemetry(w) for w in running))
+        stalled = [(worker, _stall_reason(worker)) for worker in running]
+        await asyncio.gather(
+            *(restart_worker(w, reason) for w, reason in stalled if reason is not None)
+        )
+        if time.monotonic() - last_logged < TELEMETRY_LOG_INTERVAL:
+            continue
+        last_logged = time.monotonic()
+        for worker in running:
+            if not worker.telemetry:
+                continue
+            sample = worker.telemetry[-1]
             logging.info(
-                "\033[93mExiting after installation. Please restart the script manually.\033[0m"
+                f"\033[92mWorker {worker.role}: {sample.hashrate_10s} / {sample.hashrate_60s} / "
+                f"{sample.hashrate_15m} H/s (10s/60s/15m), shares {sample.accepted} accepted / "
+                f"{sample.rejected} rejected, pool {sample.pool} {sample.pool_latency} ms\033[0m",
+                extra={
+                    "worker": worker.role,
+                    "pid": worker.process.pid,
+                    "hashrate": sample.hashrate_60s,
+                },
             )
-            sys.exit(0)
 
-        cpu_cores = await get_cpu_cores()
-        main_threads, limited_threads, free_threads = (
-            await calculate_threads_and_limits(cpu_cores)
+
+def _attribute_shares(daemon: Daemon, since: float) -> None:
+    endpoints = {_pool_address(pool.url): pool for pool in daemon.pools}
+    for pool in daemon.pools:
+        pool.accepted *= POOL_STATS_DECAY
+        pool.rejected *= POOL_STATS_DECAY
+    for worker in daemon.workers.values():
+        samples = list(worker.telemetry)
+        for previous, sample in zip(samples, samples[1:]):
+            if sample.timestamp <= since or sample.pool != previous.pool:
+                continue
+            try:
+                pool = endpoints.get(_pool_address(sample.pool or ""))
+            except ValueError:
+                pool = None
+            if pool is None:
+                continue
+            pool.accepted += max(sample.accepted - previous.accepted, 0)
+            pool.rejected += max(sample.rejected - previous.rejected, 0)
+
+
+@log_decorator
+async def rank_pools(daemon: Daemon) -> None:
+    last_ranked = time.time()
+    while True:
+        if len(daemon.pools) < 2:
+            # A reload may add more pools later.
+            await asyncio.sleep(POOL_PROBE_INTERVAL)
+            continue
+        latencies = await asyncio.gather(
+            *(probe_pool(pool.url) for pool in daemon.pools)
         )
-        commands = await create_xmrig_commands(
-            main_threads, limited_threads, free_threads
+        for pool, latency in zip(daemon.pools, latencies):
+            pool.latency = latency
+        _attribute_shares(daemon, last_ranked)
+        last_ranked = time.time()
+        ranked = sorted(daemon.pools, key=lambda pool: pool.score)
+        current = daemon.pools[0]
+        if ranked[0] is not current and (
+            current.latency is None
+            or ranked[0].score < current.score * (1 - POOL_RERANK_MARGIN)
+        ):
+            logging.info(
+                f"\033[93mSwitching preferred pool from {current.url} to {ranked[0].url} "
+                f"({ranked[0].latency * 1000:.1f} ms, {ranked[0].reject_ratio:.1%} rejected).\033[0m"
+            )
+            daemon.pools = ranked
+            if daemon.proxy is not None:
+                if daemon.proxy.upstream is not None:
+                    daemon.proxy.upstream.close()
+            else:
+                # xmrig watches its config file and reconnects to the new order.
+                await create_xmrig_commands(daemon.plan, [pool.url for pool in ranked])
+        await asyncio.sleep(POOL_PROBE_INTERVAL)
+
+
+def _send_stratum(writer: asyncio.StreamWriter, message: dict) -> None:
+    writer.write(json.dumps(message).encode() + b"\n")
+
+
+def _stratum_reply(
+    writer: asyncio.StreamWriter,
+    request_id: object,
+    result: Optional[dict] = None,
+    error: Optional[str] = None,
+) -> None:
+    _send_stratum(
+        writer,
+        {
+            "id": request_id,
+            "jsonrpc": "2.0",
+            "error": {"code": -1, "message": error} if error else None,
+            "result": result,
+        },
+    )
+
+
+def _client_job(job: dict, client: ProxyClient) -> dict:
+    client.jobs[job.get("job_id")] = time.monotonic()
+    while len(client.jobs) > PROXY_JOB_HISTORY:
+        del client.jobs[next(iter(client.jobs))]
+    # Workers run in nicehash mode and keep the top nonce byte (blob offset
+    # 42) fixed, so giving each one its own value splits the nonce space.
+    blob = job["blob"]
+    return dict(job, id=client.session, blob=f"{blob[:84]}{client.slot:02x}{blob[86:]}")
+
+
+def _proxy_set_job(proxy: StratumProxy, job: dict) -> None:
+    proxy.job = job
+    proxy.job_ready.set()
+    for client in proxy.clients.values():
+        _send_stratum(
+            client.writer,
+            {"jsonrpc": "2.0", "method": "job", "params": _client_job(job, client)},
         )
 
+
+def _proxy_drop_pending(proxy: StratumProxy, error: str) -> None:
+    for client, request_id, _ in proxy.pending.values():
+        if not client.writer.is_closing():
+            _stratum_reply(client.writer, request_id, error=error)
+    proxy.pending.clear()
+
+
+def _proxy_expire_submit(proxy: StratumProxy, upstream_id: int) -> None:
+    entry = proxy.pending.pop(upstream_id, None)
+    if entry is None:
+        return
+    client, request_id, _ = entry
+    logging.debug(
+        f"Share from {client.worker} got no reply from the pool in {PROXY_SUBMIT_TIMEOUT}s",
+        extra={"worker": client.worker},
+    )
+    if not client.writer.is_closing():
+        _stratum_reply(
+            client.writer, request_id, error="Pool did not answer the submit"
+        )
+
+
+def _share_stats(proxy: StratumProxy, worker: str, pool: str) -> ShareStats:
+    key = (worker, pool)
+    if key not in proxy.shares:
+        proxy.shares[key] = ShareStats()
+    return proxy.shares[key]
+
+
+def _record_share(
+    proxy: StratumProxy,
+    client: ProxyClient,
+    endpoint: PoolEndpoint,
+    error: Optional[dict],
+    submitted_at: float,
+) -> None:
+    stats = _share_stats(proxy, client.worker, endpoint.url)
+    stats.submit_latency.record(time.monotonic() - submitted_at)
+    if not error:
+        stats.accepted += 1
+        endpoint.accepted += 1
+        return
+    endpoint.rejected += 1
+    message = str(error.get("message", error)).lower()
+    if any(marker in message for marker in STALE_SHARE_ERRORS):
+        stats.stale += 1
+    else:
+        stats.rejected += 1
+    logging.debug(
+        f"Share from {client.worker} rejected by {endpoint.url}: {message}",
+        extra={"worker": client.worker},
+    )
+
+
+async def _proxy_upstream_session(proxy: StratumProxy, endpoint: PoolEndpoint) -> bool:
+    logged_in = False
+    writer = None
+    try:
+        host, port = _pool_address(endpoint.url)
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(host, port), POOL_PROBE_TIMEOUT
+        )
+        proxy.upstream = writer
+        _send_stratum(
+            writer,
+            {
+                "id": 1,
+                "jsonrpc": "2.0",
+                "method": "login",
+                "params": {
+                    "login": PROXY_LOGIN,
+                    "pass": PROXY_PASS,
+                    "agent": "myne-proxy",
+                    "algo": ["rx/0"],
+                },
+            },
+        )
         while True:
-            if not await check_xmrig_running():
+            try:
+                line = await asyncio.wait_for(reader.readline(), PROXY_KEEPALIVE)
+            except asyncio.TimeoutError:
+                if proxy.session is not None:
+                    _send_stratum(
+                        writer,
+                        {
+                            "id": 0,
+                            "jsonrpc": "2.0",
+                            "method": "keepalived",
+                            "params": {"id": proxy.session},
+                        },
+                    )
+                    continue
+                raise
+            if not line:
+                raise ConnectionError("connection closed by the pool")
+            message = json.loads(line)
+            if message.get("method") == "job":
+                _proxy_set_job(proxy, message["params"])
+            elif message.get("id") == 1 and not logged_in:
+                if message.get("error"):
+                    raise ConnectionError(f"login failed: {message['error']}")
+                proxy.session = message["result"]["id"]
+                proxy.endpoint = endpoint
+                logged_in = True
                 logging.info(
-                    "\033[93mxmrig is not running, attempting to start...\033[0m"
+                    f"\033[92mStratum proxy logged in to {endpoint.url}.\033[0m"
+                )
+                _proxy_set_job(proxy, message["result"]["job"])
+            elif message.get("id") in proxy.pending:
+                client, request_id, submitted_at = proxy.pending.pop(message["id"])
+                error = message.get("error")
+                _record_share(proxy, client, endpoint, error, submitted_at)
+                if not client.writer.is_closing():
+                    _stratum_reply(
+                        client.writer,
+                        request_id,
+                        result=message.get("result"),
+                        error=error.get("message", str(error)) if error else None,
+                    )
+    except (OSError, asyncio.TimeoutError, ValueError, KeyError) as e:
+        logging.warning(
+            f"\033[93mStratum proxy lost upstream pool {endpoint.url}: {e}\033[0m"
+        )
+    finally:
+        proxy.upstream = None
+        proxy.session = None
+        proxy.endpoint = None
+        proxy.job_ready.clear()
+        _proxy_drop_pending(proxy, "Upstream pool connection lost")
+        if writer is not None:
+            writer.close()
+    return logged_in
+
+
+@log_decorator
+async def run_stratum_proxy(daemon: Daemon) -> None:
+    attempt = 0
+    while True:
+        for endpoint in list(daemon.pools):
+            if await _proxy_upstream_session(daemon.proxy, endpoint):
+                attempt = 0
+                break
+        else:
+            attempt += 1
+        await asyncio.sleep(
+            _backoff_delay(PROXY_BACKOFF_BASE, attempt, PROXY_BACKOFF_MAX)
+        )
+
+
+async def _proxy_client(
+    proxy: StratumProxy, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+) -> None:
+    client = None
+    try:
+        while line := await reader.readline():
+            message = json.loads(line)
+            method = message.get("method")
+            request_id = message.get("id")
+            if method == "login":
+                try:
+                    await asyncio.wait_for(proxy.job_ready.wait(), PROXY_LOGIN_TIMEOUT)
+                except asyncio.TimeoutError:
+                    _stratum_reply(
+                        writer, request_id, error="No job from the upstream pool yet"
+                    )
+                    continue
+                # A repeated login on the same connection keeps its slot so
+                # it does not use up another nonce byte.
+                if client is None:
+                    slot = next(
+                        (s for s in range(PROXY_MAX_CLIENTS) if s not in proxy.clients),
+                        None,
+                    )
+                    if slot is None:
+                        _stratum_reply(writer, request_id, error="Proxy is full")
+                        break
+                    client = ProxyClient(slot=slot, writer=writer)
+                    proxy.clients[slot] = client
+                params = message.get("params", {})
+                client.worker = params.get("rigid") or client.session
+                _stratum_reply(
+                    writer,
+                    request_id,
+                    result={
+                        "id": client.session,
+                        "job": _client_job(proxy.job, client),
+                        "status": "OK",
+                    },
+                )
+            elif method == "submit":
+                if client is None:
+                    _stratum_reply(writer, request_id, error="Unauthenticated")
+                    continue
+                if proxy.upstream is None or proxy.session is None:
+                    _stratum_reply(
+                        writer, request_id, error="Upstream pool is unavailable"
+                    )
+                    continue
+                upstream_id = proxy.next_id
+                proxy.next_id += 1
+                now = time.monotonic()
+                proxy.pending[upstream_id] = (client, request_id, now)
+                asyncio.get_running_loop().call_later(
+                    PROXY_SUBMIT_TIMEOUT, _proxy_expire_submit, proxy, upstream_id
+                )
+                # Only the first share per job measures job-switch and network
+                # delay; later ones measure how long mining took.
+                received_at = client.jobs.pop(
+                    message.get("params", {}).get("job_id"), None
                 )
-                for command in commands:
-                    pid = await run_xmrig_command(command)
-                    logging.info(f"\033[92mStarted xmrig with PID: {pid}\033[0m")
-                    if not await check_xmrig_running():
-                        logging.error(
-                            "\033[91mxmrig failed to start or is not running, retrying...\033[0m"
+                if received_at is not None and proxy.endpoint is not None:
+                    _share_stats(
+                        proxy, client.worker, proxy.endpoint.url
+                    ).job_latency.record(now - received_at)
+                _send_stratum(
+                    proxy.upstream,
+                    {
+                        "id": upstream_id,
+                        "jsonrpc": "2.0",
+                        "method": "submit",
+                        "params": dict(message.get("params", {}), id=proxy.session),
+                    },
+                )
+            elif method == "keepalived":
+                _stratum_reply(writer, request_id, result={"status": "KEEPALIVED"})
+            else:
+                _stratum_reply(writer, request_id, error=f"Unsupported method {method}")
+    except (OSError, ValueError) as e:
+        logging.warning(f"\033[93mStratum proxy client error: {e}\033[0m")
+    finally:
+        if client is not None:
+            proxy.clients.pop(client.slot, None)
+        writer.close()
+
+
+@log_decorator
+async def log_share_stats(proxy: StratumProxy) -> None:
+    while True:
+        await asyncio.sleep(TELEMETRY_LOG_INTERVAL)
+        for (worker, pool), stats in sorted(proxy.shares.items()):
+            if not stats.total:
+                continue
+            logging.info(
+                f"\033[92mShares from {worker} to {pool}: {stats.total} submitted, "
+                f"{stats.stale / stats.total:.1%} stale, {stats.rejected / stats.total:.1%} rejected, "
+                f"job-to-first-share p50 <= {stats.job_latency.percentile(0.5)}s "
+                f"p95 <= {stats.job_latency.percentile(0.95)}s, "
+                f"pool reply p50 <= {stats.submit_latency.percentile(0.5)}s\033[0m",
+                extra={"worker": worker},
+            )
+
+
+@log_decorator
+async def serve_stratum_proxy(daemon: Daemon) -> asyncio.AbstractServer:
+    daemon.proxy = StratumProxy()
+    return await asyncio.start_server(
+        lambda reader, writer: _proxy_client(daemon.proxy, reader, writer),
+        PROXY_HOST,
+        PROXY_PORT,
+    )
+
+
+def _telemetry_report(workers: Dict[str, Worker]) -> dict:
+    return {
+        role: {
+            "state": worker.state.value,
+            "pid": worker.process.pid if worker.process else None,
+            "threads": worker.threads,
+            "restarts": worker.restarts,
+            "telemetry": [sample.__dict__ for sample in worker.telemetry],
+        }
+        for role, worker in workers.items()
+    }
+
+
+def _metric(
+    lines: List[str], name: str, kind: str, help_text: str, samples: list
+) -> None:
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} {kind}")
+    for labels, value in samples:
+        label_text = ",".join(f'{key}="{val}"' for key, val in labels.items())
+        lines.append(f"{name}{{{label_text}}} {value}" if labels else f"{name} {value}")
+
+
+def _histogram(lines: List[str], name: str, help_text: str, samples: list) -> None:
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} histogram")
+    for labels, histogram in samples:
+        label_text = "".join(f'{key}="{val}",' for key, val in labels.items())
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS + ("+Inf",), histogram.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{label_text}le="{bound}"}} {cumulative}')
+        label_text = label_text.rstrip(",")
+        lines.append(f"{name}_sum{{{label_text}}} {histogram.total}")
+        lines.append(f"{name}_count{{{label_text}}} {histogram.count}")
+
+
+def _metrics_text(daemon: Daemon) -> str:
+    workers = daemon.workers.values()
+    now = time.monotonic()
+    lines = []
+    _metric(
+        lines,
+        "myne_planned_threads",
+        "gauge",
+        "Threads planned for each worker.",
+        [({"worker": w.role}, w.threads) for w in daemon.plan.workers],
+    )
+    _metric(
+        lines,
+        "myne_running_threads",
+        "gauge",
+        "Threads of each worker that is currently running.",
+        [
+            ({"worker": w.role}, w.threads if w.state == WorkerState.RUNNING else 0)
+            for w in workers
+        ],
+    )
+    _metric(
+        lines,
+        "myne_worker_hashrate",
+        "gauge",
+        "Last reported hashrate in H/s.",
+        [
+            ({"worker": w.role, "window": window}, getattr(w.telemetry[-1], field_name))
+            for w in workers
+            if w.telemetry
+            for window, field_name in (
+                ("10s", "hashrate_10s"),
+                ("60s", "hashrate_60s"),
+                ("15m", "hashrate_15m"),
+            )
+            if getattr(w.telemetry[-1], field_name) is not None
+        ],
+    )
+    _metric(
+        lines,
+        "myne_worker_shares",
+        "gauge",
+        "Shares reported by the worker since it started.",
+        [
+            ({"worker": w.role, "result": result}, getattr(w.telemetry[-1], result))
+            for w in workers
+            if w.telemetry
+            for result in ("accepted", "rejected")
+        ],
+    )
+    _metric(
+        lines,
+        "myne_worker_restarts_total",
+        "counter",
+        "Worker restarts since the daemon started.",
+        [({"worker": w.role}, w.restarts) for w in workers],
+    )
+    _metric(
+        lines,
+        "myne_worker_crashes",
+        "gauge",
+        "Consecutive quick failures counted towards the crash-loop threshold.",
+        [({"worker": w.role}, w.crashes) for w in workers],
+    )
+    _metric(
+        lines,
+        "myne_worker_parked",
+        "gauge",
+        "Whether the worker is parked after a crash loop.",
+        [({"worker": w.role}, int(w.state == WorkerState.PARKED)) for w in workers],
+    )
+    _metric(
+        lines,
+        "myne_worker_backoff_seconds",
+        "gauge",
+        "Seconds left before the worker is restarted.",
+        [
+            ({"worker": w.role}, round(max(w.backoff_until - now, 0.0), 3))
+            for w in workers
+        ],
+    )
+    _metric(
+        lines,
+        "myne_throttle_quota_cpus",
+        "gauge",
+        "CPU quota of throttled workers in CPUs.",
+        [
+            ({"worker": w.role}, w.throttle.limit * w.threads / 100)
+            for w in workers
+            if w.throttle is not None
+        ],
+    )
+    _metric(
+        lines,
+        "myne_hugepages",
+        "gauge",
+        "Huge pages needed by the thread plan and actually reserved per node.",
+        [
+            ({"node": node, "kind": kind}, value)
+            for node, (pages, achieved) in sorted(daemon.hugepages.items())
+            for kind, value in (("expected", pages), ("achieved", achieved))
+        ],
+    )
+    _metric(
+        lines,
+        "myne_pool_latency_seconds",
+        "gauge",
+        "TCP connect latency to each pool, in preference order.",
+        [
+            ({"pool": pool.url, "rank": rank}, round(pool.latency, 6))
+            for rank, pool in enumerate(daemon.pools)
+            if pool.latency is not None
+        ],
+    )
+    _metric(
+        lines,
+        "myne_pool_rejected_ratio",
+        "gauge",
+        "Recent fraction of rejected shares per pool.",
+        [({"pool": pool.url}, round(pool.reject_ratio, 4)) for pool in daemon.pools],
+    )
+    if daemon.proxy is not None:
+        _metric(
+            lines,
+            "myne_proxy_clients",
+            "gauge",
+            "Workers connected to the local stratum proxy.",
+            [({}, len(daemon.proxy.clients))],
+        )
+        _metric(
+            lines,
+            "myne_proxy_upstream_connected",
+            "gauge",
+            "Whether the stratum proxy is logged in to a pool.",
+            [
+                (
+                    {
+                        "pool": (
+                            daemon.proxy.endpoint.url if daemon.proxy.endpoint else ""
                         )
+                    },
+                    int(daemon.proxy.session is not None),
+                )
+            ],
+        )
+        shares = sorted(daemon.proxy.shares.items())
+        _metric(
+            lines,
+            "myne_shares_total",
+            "counter",
+            "Shares submitted through the stratum proxy by outcome.",
+            [
+                (
+                    {"worker": worker, "pool": pool, "result": result},
+                    getattr(stats, result),
+                )
+                for (worker, pool), stats in shares
+                for result in ("accepted", "rejected", "stale")
+            ],
+        )
+        _histogram(
+            lines,
+            "myne_share_job_latency_seconds",
+            "Time from handing a job to a worker until its first share for it.",
+            [({"worker": w, "pool": p}, stats.job_latency) for (w, p), stats in shares],
+        )
+        _histogram(
+            lines,
+            "myne_share_submit_latency_seconds",
+            "Time for the pool to answer a share submitted through the proxy.",
+            [
+                ({"worker": w, "pool": p}, stats.submit_latency)
+                for (w, p), stats in shares
+            ],
+        )
+    _metric(
+        lines,
+        "myne_loop_lag_seconds",
+        "gauge",
+        "Event loop scheduling lag.",
+        [({}, round(daemon.loop_lag, 6))],
+    )
+    if latency_histograms:
+        _histogram(
+            lines,
+            "myne_call_duration_seconds",
+            "Duration of daemon operations.",
+            [
+                ({"function": name}, histogram)
+                for name, histogram in sorted(latency_histograms.items())
+            ],
+        )
+    return "\n".join(lines) + "\n"
+
+
+@log_decorator
+async def serve_status(daemon: Daemon) -> asyncio.AbstractServer:
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request = await reader.readline()
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+            parts = request.split()
+            path = parts[1].decode() if len(parts) > 1 else ""
+            content_type = "application/json"
+            if path == "/telemetry":
+                status = "200 OK"
+                body = json.dumps(_telemetry_report(daemon.workers)).encode()
+            elif path == "/metrics":
+                status = "200 OK"
+                content_type = "text/plain; version=0.0.4"
+                body = _metrics_text(daemon).encode()
             else:
-                logging.info("\033[92mxmrig is running.\033[0m")
-            try:
-                await asyncio.sleep(SLEEP_INTERVAL)
-            except KeyboardInterrupt:
-                logging.info("\033[93mKeyboardInterrupt received, stopping...\033[0m")
-                await kill_xmrig()
-                sys.exit(0)
+                status = "404 Not Found"
+                body = b"{}"
+            writer.write(
+                f"HTTP/1.0 {status}\r\nContent-Type: {content_type}\r\n"
+                f"Content-Length: {len(body)}\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        finally:
+            writer.close()
+
+    if STATUS_SOCKET is not None:
+        return await asyncio.start_unix_server(handle, STATUS_SOCKET)
+    return await asyncio.start_server(handle, STATUS_HOST, STATUS_PORT)
+
+
+async def monitor_loop_lag(daemon: Daemon) -> None:
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + LOOP_LAG_INTERVAL
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        daemon.loop_lag = max(loop.time() - expected, 0.0)
+
+
+async def dump_latency_histograms() -> None:
+    while True:
+        await asyncio.sleep(LATENCY_DUMP_INTERVAL)
+        log_latency_histograms()
+
+
+@dataclass
+class BenchmarkResult:
+    name: str
+    cpus: List[int]
+    pin_threads: bool
+    huge_pages: bool
+    seconds: float
+    hashrate: float
+    joules: Optional[float]
+    cpu_seconds: float
+
+    @property
+    def hashes_per_joule(self) -> Optional[float]:
+        if not self.joules:
+            return None
+        return self.hashrate * self.seconds / self.joules
+
+
+def _parse_hash_count(size: str) -> int:
+    units = {"K": 1000, "M": 1000 * 1000}
+    if size[-1].upper() in units:
+        return int(size[:-1]) * units[size[-1].upper()]
+    return int(size)
+
+
+def _read_rapl_energy() -> Optional[Tuple[float, float]]:
+    energy = 0.0
+    wrap = 0.0
+    found = False
+    for path in glob.glob(os.path.join(RAPL_PATH, "intel-rapl:[0-9]*")):
+        if ":" in os.path.basename(path)[len("intel-rapl:") :]:
+            continue
+        value = _read_sysfs(os.path.join(path, "energy_uj"))
+        max_value = _read_sysfs(os.path.join(path, "max_energy_range_uj"))
+        if value is None:
+            continue
+        found = True
+        energy += int(value) / 1e6
+        wrap = max(wrap, int(max_value or 0) / 1e6)
+    return (energy, wrap) if found else None
+
+
+def _reserved_cpus(plan: ThreadPlan, topology: Topology) -> set:
+    # The free worker owns its whole physical cores, siblings too; the
+    # limited worker only its own CPUs.
+    cores = {
+        (info.package, info.core)
+        for info in topology.cpus
+        for w in plan.workers
+        if w.role == "free" and info.cpu in w.cpus
+    }
+    return {
+        info.cpu for info in topology.cpus if (info.package, info.core) in cores
+    } | {cpu for w in plan.workers if w.role == "limited" for cpu in w.cpus}
+
+
+def _read_json(path: str) -> Optional[dict]:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logging.warning(f"\033[93mIgnoring unreadable {path}: {e}\033[0m")
+        return None
+
+
+def _cpu_models() -> List[str]:
+    try:
+        with open("/proc/cpuinfo") as f:
+            return sorted(
+                {
+                    line.split(":", 1)[1].strip()
+                    for line in f
+                    if line.startswith("model name")
+                }
+            )
+    except OSError:
+        return []
+
+
+def _memory_total() -> Optional[str]:
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemTotal:"):
+                    return line.split(":", 1)[1].strip()
+    except OSError:
+        pass
+    return None
+
+
+@log_decorator
+async def host_fingerprint(cpu_cores: int, topology: Topology) -> str:
+    try:
+        xmrig_hash = await calculate_file_hash(XMRIG_PATH)
+    except OSError:
+        xmrig_hash = None
+    fingerprint = {
+        "cpu_models": _cpu_models(),
+        "cpu_cores": cpu_cores,
+        "cpus": [[c.cpu, c.core, c.package, c.node] for c in topology.cpus],
+        "l3": sorted([sorted(shared), size] for shared, size in topology.l3_domains),
+        "memory": _memory_total(),
+        "xmrig": xmrig_hash,
+        "settings": [CPU_LIMIT_THRESHOLD, API_PORT_BASE],
+    }
+    return hashlib.sha256(json.dumps(fingerprint, sort_keys=True).encode()).hexdigest()
+
+
+async def _profile_hash() -> Optional[str]:
+    try:
+        return await calculate_file_hash(PROFILE_PATH)
+    except OSError:
+        return None
+
+
+@log_decorator
+async def load_cached_plan(fingerprint: str) -> Optional[ThreadPlan]:
+    cache = await asyncio.get_running_loop().run_in_executor(
+        None, _read_json, PLAN_CACHE_PATH
+    )
+    if cache is None:
+        return None
+    if cache.get("fingerprint") != fingerprint:
+        logging.info(
+            "\033[93mHost fingerprint changed, discarding the cached thread plan.\033[0m"
+        )
+        return None
+    # The planner itself lives in this script, so a new version replans too.
+    if cache.get("myne") != await calculate_file_hash(SCRIPT_PATH):
+        return None
+    if cache.get("profile") != await _profile_hash():
+        logging.info(
+            "\033[93mTuning profile changed, discarding the cached thread plan.\033[0m"
+        )
+        return None
+    logging.info(f"\033[92mUsing cached thread plan from {PLAN_CACHE_PATH}\033[0m")
+    return ThreadPlan(workers=[WorkerPlan(**worker) for worker in cache["workers"]])
+
+
+@log_decorator
+async def save_cached_plan(fingerprint: str, plan: ThreadPlan) -> None:
+    cache = {
+        "fingerprint": fingerprint,
+        "myne": await calculate_file_hash(SCRIPT_PATH),
+        "profile": await _profile_hash(),
+        "created": time.time(),
+        "workers": [asdict(worker) for worker in plan.workers],
+    }
+    try:
+        await asyncio.get_running_loop().run_in_executor(
+            None, _write_json_atomic, PLAN_CACHE_PATH, cache
+        )
+    except OSError as e:
+        logging.warning(f"\033[93mCould not cache the thread plan: {e}\033[0m")
+
+
+@log_decorator
+async def load_tuning_profile(fingerprint: str) -> Optional[dict]:
+    profile = await asyncio.get_running_loop().run_in_executor(
+        None, _read_json, PROFILE_PATH
+    )
+    if profile is not None and profile.get("fingerprint") != fingerprint:
+        logging.info(
+            "\033[93mTuning profile was measured on different hardware or binaries, ignoring it.\033[0m"
+        )
+        return None
+    return profile
+
+
+@log_decorator
+async def apply_tuning_profile(
+    plan: ThreadPlan, topology: Topology, profile: dict
+) -> ThreadPlan:
+    layout = profile.get("layout")
+    if not layout:
+        return plan
+    reserved = _reserved_cpus(plan, topology)
+    nodes = {info.cpu: info.node for info in topology.cpus}
+    node_cpus = {}
+    for cpu in layout["cpus"]:
+        if cpu in nodes and cpu not in reserved:
+            node_cpus.setdefault(nodes[cpu], []).append(cpu)
+    if not node_cpus:
+        logging.warning(
+            "\033[93mTuning profile does not fit this host's CPUs, using the planner.\033[0m"
+        )
+        return plan
+    main_workers = [
+        WorkerPlan(
+            role="main" if len(node_cpus) == 1 else f"main-node{node}",
+            threads=len(cpus),
+            cpus=cpus,
+            node=node,
+            pin_threads=layout["pin_threads"],
+            huge_pages=layout["huge_pages"],
+        )
+        for node, cpus in sorted(node_cpus.items())
+    ]
+    workers = main_workers + [w for w in plan.workers if not w.role.startswith("main")]
+    for index, worker in enumerate(workers):
+        worker.api_port = API_PORT_BASE + index
+    logging.info(
+        f"\033[92mUsing benchmarked layout {layout['name']} with "
+        f"{sum(w.threads for w in main_workers)} main threads.\033[0m"
+    )
+    return ThreadPlan(workers=workers)
+
+
+@log_decorator
+async def benchmark_layout(
+    name: str, cpus: List[int], pin_threads: bool, huge_pages: bool
+) -> Optional[BenchmarkResult]:
+    plan = WorkerPlan(
+        role="benchmark",
+        threads=len(cpus),
+        cpus=cpus,
+        pin_threads=pin_threads,
+        huge_pages=huge_pages,
+    )
+    config = create_xmrig_config(plan, cuda=False, numa=True)
+    config["http"]["enabled"] = False
+    config_path = os.path.join(XMRIG_CONFIG_DIR, "benchmark.json")
+    await asyncio.get_running_loop().run_in_executor(
+        None, _write_json_atomic, config_path, config
+    )
+    worker = Worker(role="benchmark", command=[], threads=len(cpus), cpus=cpus)
+    energy_before = _read_rapl_energy()
+    usage_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    started = time.monotonic()
+    process = await asyncio.create_subprocess_exec(
+        *_worker_command(
+            worker,
+            [
+                XMRIG_PATH,
+                f"--config={config_path}",
+                f"--bench={BENCHMARK_SIZE}",
+                "--no-color",
+            ],
+        ),
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.STDOUT,
+    )
+    try:
+        output, _ = await asyncio.wait_for(process.communicate(), BENCHMARK_TIMEOUT)
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+        logging.error(f"\033[91mBenchmark {name} timed out.\033[0m")
+        return None
+    elapsed = time.monotonic() - started
+    usage_after = resource.getrusage(resource.RUSAGE_CHILDREN)
+    energy_after = _read_rapl_energy()
+
+    match = re.search(rb"benchmark finished in\s+([0-9.]+)\s*s", output)
+    if process.returncode != 0 or match is None:
+        logging.error(
+            f"\033[91mBenchmark {name} failed with exit code {process.returncode}.\033[0m"
+        )
+        return None
+    seconds = float(match.group(1))
+    joules = None
+    if energy_before is not None and energy_after is not None:
+        joules = energy_after[0] - energy_before[0]
+        if joules < 0:
+            joules += energy_before[1]
+        # The counters cover the whole run, including dataset setup.
+        joules *= seconds / elapsed
+    result = BenchmarkResult(
+        name=name,
+        cpus=cpus,
+        pin_threads=pin_threads,
+        huge_pages=huge_pages,
+        seconds=seconds,
+        hashrate=_parse_hash_count(BENCHMARK_SIZE) / seconds,
+        joules=joules,
+        cpu_seconds=(usage_after.ru_utime + usage_after.ru_stime)
+        - (usage_before.ru_utime + usage_before.ru_stime),
+    )
+    logging.info(
+        f"\033[92mBenchmark {name}: {result.hashrate:.1f} H/s on {len(cpus)} threads, "
+        f"{result.cpu_seconds:.0f} CPU s"
+        f"{f', {result.hashes_per_joule:.1f} H/J' if result.hashes_per_joule else ''}\033[0m"
+    )
+    return result
+
+
+@log_decorator
+async def run_benchmark() -> Optional[BenchmarkResult]:
+    if await check_xmrig_running():
+        logging.error(
+            "\033[91mxmrig is already running; stop the myne service before "
+            "benchmarking so the layouts do not compete for the same cores.\033[0m"
+        )
+        return None
+    cpu_cores = await get_cpu_cores()
+    topology = await read_topology()
+    fingerprint = await host_fingerprint(cpu_cores, topology)
+    plan = await calculate_threads_and_limits(cpu_cores, topology)
+    reserved = _reserved_cpus(plan, topology)
+    available = sorted(
+        (info for info in topology.cpus if info.cpu not in reserved),
+        key=lambda info: (info.sibling, info.cpu),
+    )
+    smt_layouts = {
+        "smt": [info.cpu for info in available],
+        "nosmt": [info.cpu for info in available if info.sibling == 0],
+    }
+    planned = plan.role_threads("main")
+    # Never run more main threads than the CPU quota leaves for them.
+    budget = cpu_cores - sum(
+        w.threads for w in plan.workers if not w.role.startswith("main")
+    )
+    layouts = []
+    for smt, cpus in smt_layouts.items():
+        cpus = cpus[:budget]
+        counts = {len(cpus), planned, len(cpus) * 3 // 4, len(cpus) // 2}
+        for count in sorted(c for c in counts if 0 < c <= len(cpus)):
+            layouts.append((f"{smt}-{count}", cpus[:count]))
+    if not layouts:
+        logging.error("\033[91mNo CPUs are left for benchmark layouts.\033[0m")
+        return None
+
+    # Size the reservation for the largest layout so none of them falls back
+    # to regular pages.
+    largest = max(len(cpus) for _, cpus in layouts)
+    await prepare_hugepages(ThreadPlan(workers=[WorkerPlan("benchmark", largest)]))
+    await prepare_msr()
+
+    results = []
+    for name, cpus in layouts:
+        result = await benchmark_layout(name, cpus, pin_threads=True, huge_pages=True)
+        if result is not None:
+            results.append(result)
+    if not results:
+        logging.error("\033[91mNo benchmark layout completed.\033[0m")
+        return None
+
+    best = max(results, key=lambda r: r.hashrate)
+    for pin_threads, huge_pages, suffix in (
+        (False, True, "unpinned"),
+        (True, False, "nohugepages"),
+    ):
+        result = await benchmark_layout(
+            f"{best.name}-{suffix}", best.cpus, pin_threads, huge_pages
+        )
+        if result is not None:
+            results.append(result)
+    best = max(results, key=lambda r: r.hashrate)
+
+    profile = {
+        "fingerprint": fingerprint,
+        "created": time.time(),
+        "layout": {
+            "name": best.name,
+            "cpus": best.cpus,
+            "pin_threads": best.pin_threads,
+            "huge_pages": best.huge_pages,
+            "hashrate": best.hashrate,
+            "hashes_per_joule": best.hashes_per_joule,
+        },
+        "results": [
+            dict(r.__dict__, hashes_per_joule=r.hashes_per_joule) for r in results
+        ],
+    }
+    await asyncio.get_running_loop().run_in_executor(
+        None, _write_json_atomic, PROFILE_PATH, profile
+    )
+    logging.info(
+        f"\033[92mBest layout {best.name} at {best.hashrate:.1f} H/s saved to {PROFILE_PATH}\033[0m"
+    )
+    return best
+
+
+@dataclass
+class Settings:
+    pool_hosts: List[str] = field(default_factory=partial(list, tuple(POOL_HOSTS)))
+    pool_probe_interval: float = POOL_PROBE_INTERVAL
+    stratum_proxy: bool = STRATUM_PROXY
+    proxy_host: str = PROXY_HOST
+    proxy_port: int = PROXY_PORT
+    proxy_login: str = PROXY_LOGIN
+    proxy_pass: str = PROXY_PASS
+    xmrig_path: str = XMRIG_PATH
+    randomx_mode: str = RANDOMX_MODE
+    auto_benchmark: bool = AUTO_BENCHMARK
+    hugepages_required: bool = HUGEPAGES_REQUIRED
+    cpu_limit_threshold: int = CPU_LIMIT_THRESHOLD
+    cpu_limit_high: int = CPU_LIMIT_HIGH
+    cpu_limit_low: int = CPU_LIMIT_LOW
+    limited_niceness: int = LIMITED_NICENESS
+    usage_limit: float = USAGE_LIMIT
+    throttle_interval: float = THROTTLE_INTERVAL
+    throttle_hysteresis: int = THROTTLE_HYSTERESIS
+    telemetry_interval: float = TELEMETRY_INTERVAL
+    telemetry_log_interval: float = TELEMETRY_LOG_INTERVAL
+    stall_hashrate_fraction: float = STALL_HASHRATE_FRACTION
+    stall_share_timeout: float = STALL_SHARE_TIMEOUT
+    api_port_base: int = API_PORT_BASE
+    status_host: str = STATUS_HOST
+    status_port: int = STATUS_PORT
+
+
+def _config_path() -> Optional[str]:
+    if CONFIG_PATH is not None:
+        return CONFIG_PATH
+    for name in CONFIG_NAMES:
+        path = os.path.join(CONFIG_DIR, name)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def _check_setting(name: str, expected: type, value: object) -> object:
+    if expected is List[str]:
+        if isinstance(value, list) and all(isinstance(v, str) for v in value):
+            return value
+    elif expected is float:
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return float(value)
+    elif expected is int:
+        if isinstance(value, int) and not isinstance(value, bool):
+            return value
+    elif isinstance(value, expected):
+        return value
+    names = {
+        bool: "a boolean",
+        int: "an integer",
+        float: "a number",
+        str: "a string",
+    }
+    raise ValueError(f"{name} must be {names.get(expected, 'a list of strings')}")
+
+
+def _validate_settings(settings: Settings) -> None:
+    if not settings.pool_hosts:
+        raise ValueError("pool_hosts must not be empty")
+    for url in settings.pool_hosts:
+        _pool_address(url)
+    if not 0 < settings.cpu_limit_low <= settings.cpu_limit_high <= 100:
+        raise ValueError("need 0 < cpu_limit_low <= cpu_limit_high <= 100")
+    if not 0 < settings.usage_limit <= 1:
+        raise ValueError("usage_limit must be in (0, 1]")
+    if not 0 < settings.stall_hashrate_fraction < 1:
+        raise ValueError("stall_hashrate_fraction must be in (0, 1)")
+    if settings.randomx_mode not in ("fast", "light"):
+        raise ValueError("randomx_mode must be fast or light")
+    for name in ("proxy_port", "api_port_base", "status_port"):
+        if not 0 < getattr(settings, name) < 65536:
+            raise ValueError(f"{name} must be a TCP port")
+    for name in (
+        "pool_probe_interval",
+        "throttle_interval",
+        "telemetry_interval",
+        "telemetry_log_interval",
+        "stall_share_timeout",
+    ):
+        if getattr(settings, name) <= 0:
+            raise ValueError(f"{name} must be positive")
+    if settings.cpu_limit_threshold < 1:
+        raise ValueError("cpu_limit_threshold must be at least 1")
+    if not -20 <= settings.limited_niceness <= 19:
+        raise ValueError("limited_niceness must be between -20 and 19")
+    if not 0 <= settings.throttle_hysteresis <= 100:
+        raise ValueError("throttle_hysteresis must be between 0 and 100")
+    for name in ("xmrig_path", "proxy_host", "status_host"):
+        if not getattr(settings, name):
+            raise ValueError(f"{name} must not be empty")
+
+
+def load_settings() -> Settings:
+    path = _config_path()
+    if path is None:
+        return Settings()
+    with open(path, "rb") as f:
+        if path.endswith(".toml"):
+            if tomllib is None:
+                raise ValueError(f"{path} needs Python 3.11 or newer for tomllib")
+            data = tomllib.load(f)
+        else:
+            data = json.load(f)
+    if not isinstance(data, dict):
+        raise ValueError(f"{path} must contain a table of settings")
+    hosts = data.pop("hosts", {})
+    if not isinstance(hosts, dict):
+        raise ValueError(f"hosts in {path} must be a table of host names")
+    for name, overrides in hosts.items():
+        if not isinstance(overrides, dict):
+            raise ValueError(f"hosts.{name} in {path} must be a table")
+    hostname = platform.node()
+    for name in (hostname.split(".")[0], hostname):
+        data.update(hosts.get(name, {}))
+    types = {f.name: f.type for f in fields(Settings)}
+    unknown = sorted(set(data) - set(types))
+    if unknown:
+        raise ValueError(f"unknown settings in {path}: {', '.join(unknown)}")
+    settings = Settings(
+        **{name: _check_setting(name, types[name], v) for name, v in data.items()}
+    )
+    _validate_settings(settings)
+    logging.info(f"\033[92mLoaded settings from {path}\033[0m")
+    return settings
+
+
+def apply_settings(settings: Settings) -> None:
+    # The module constants stay the single source the daemon reads; the
+    # config file only replaces their values.
+    for name, value in asdict(settings).items():
+        globals()[name.upper()] = value
+
+
+@log_decorator
+async def plan_threads(benchmark: bool) -> ThreadPlan:
+    cpu_cores = await get_cpu_cores()
+    topology = await read_topology()
+    fingerprint = await host_fingerprint(cpu_cores, topology)
+    plan = await load_cached_plan(fingerprint)
+    if plan is None:
+        plan = await calculate_threads_and_limits(cpu_cores, topology)
+        profile = await load_tuning_profile(fingerprint)
+        if profile is None and benchmark:
+            await run_benchmark()
+            profile = await load_tuning_profile(fingerprint)
+        if profile is not None:
+            plan = await apply_tuning_profile(plan, topology, profile)
+        await save_cached_plan(fingerprint, plan)
+    return plan
+
+
+def _supervisor_done(task: asyncio.Task) -> None:
+    if not task.cancelled() and task.exception() is not None:
+        logging.error(
+            f"\033[91mWorker supervisor {task.get_name()} failed: {task.exception()}\033[0m"
+        )
+
+
+def start_supervisor(daemon: Daemon, worker: Worker) -> None:
+    task = asyncio.create_task(
+        supervise_worker(worker, daemon), name=f"supervise-{worker.role}"
+    )
+    task.add_done_callback(_supervisor_done)
+    daemon.supervisors[worker.role] = task
+
+
+def _current_settings() -> Settings:
+    return Settings(**{f.name: globals()[f.name.upper()] for f in fields(Settings)})
+
+
+@log_decorator
+async def reload_daemon(daemon: Daemon) -> None:
+    previous = _current_settings()
+    pools = daemon.pools
+    try:
+        await _reload(daemon, previous)
+    except Exception as e:
+        apply_settings(previous)
+        daemon.pools = pools
+        logging.error(f"\033[91mReload failed, keeping the current plan: {e!r}\033[0m")
+        try:
+            await create_xmrig_commands(daemon.plan, [pool.url for pool in pools])
+        except Exception as e:
+            logging.error(f"\033[91mCould not restore worker configs: {e!r}\033[0m")
+
+
+async def _reload(daemon: Daemon, previous: Settings) -> None:
+    loop = asyncio.get_running_loop()
+    try:
+        settings = await loop.run_in_executor(None, load_settings)
+    except (OSError, ValueError) as e:
+        logging.error(f"\033[91mNot reloading, invalid configuration: {e}\033[0m")
+        return
+    # Listeners are bound once at startup; keep the running values so
+    # worker configs never point at a proxy that is not listening.
+    for name in RESTART_SETTINGS:
+        if getattr(settings, name) != getattr(previous, name):
+            logging.warning(f"\033[93m{name} only takes effect after a restart.\033[0m")
+    settings = replace(
+        settings, **{name: getattr(previous, name) for name in RESTART_SETTINGS}
+    )
+    apply_settings(settings)
+
+    # rank_pools reorders daemon.pools, so only membership counts; pools
+    # that stay keep their ranked order and new ones go last.
+    known = {pool.url for pool in daemon.pools}
+    if known != set(POOL_HOSTS):
+        daemon.pools = [pool for pool in daemon.pools if pool.url in POOL_HOSTS] + [
+            PoolEndpoint(url=url) for url in POOL_HOSTS if url not in known
+        ]
+        proxy = daemon.proxy
+        if (
+            proxy is not None
+            and proxy.upstream is not None
+            and proxy.endpoint is not None
+            and proxy.endpoint.url not in POOL_HOSTS
+        ):
+            proxy.upstream.close()
+
+    plan = await plan_threads(benchmark=False)
+    # Unchanged workers pick up new pools and options through xmrig's
+    # config watcher; only workers whose layout moved are restarted.
+    commands = await create_xmrig_commands(plan, [pool.url for pool in daemon.pools])
+    old = {worker.role: worker for worker in daemon.plan.workers}
+    new = {worker.role: worker for worker in plan.workers}
+    changed = {
+        role
+        for role in old.keys() & new.keys()
+        if old[role] != new[role] or daemon.workers[role].command != commands[role]
+    }
+    removed = old.keys() - new.keys()
+    added = new.keys() - old.keys()
+    daemon.plan = plan
+
+    for role in changed | removed:
+        daemon.supervisors.pop(role).cancel()
+    await asyncio.gather(
+        *(stop_worker(daemon.workers[role]) for role in changed | removed)
+    )
+    for role in removed:
+        del daemon.workers[role]
+    for role in added:
+        daemon.workers[role] = Worker(role=role, command=commands[role], threads=0)
+    for role in changed | added:
+        worker = daemon.workers[role]
+        worker.command = commands[role]
+        _update_worker(worker, new[role])
+        worker.crashes = 0
+        worker.stalls = 0
+
+    limited = daemon.workers.get("limited")
+    if limited is not None:
+        if limited.throttle is None:
+            limited.throttle = await create_throttle(CPU_LIMIT_LOW, limited.threads)
+        else:
+            limited.throttle.threads = limited.threads
+            limited.throttle.limit = min(
+                max(limited.throttle.limit, CPU_LIMIT_LOW), CPU_LIMIT_HIGH
+            )
+            await apply_throttle(limited.throttle)
+    if changed or added:
+        daemon.hugepages = await prepare_hugepages(plan)
+    for role in changed | added:
+        start_supervisor(daemon, daemon.workers[role])
+    logging.info(
+        f"\033[92mReloaded configuration: {len(changed)} workers restarted, "
+        f"{len(added)} added, {len(removed)} removed.\033[0m"
+    )
+
+
+def _config_mtime() -> Optional[float]:
+    path = _config_path()
+    try:
+        return os.stat(path).st_mtime if path else None
+    except OSError:
+        return None
+
+
+@log_decorator
+async def watch_config(daemon: Daemon) -> None:
+    mtime = _config_mtime()
+    while True:
+        try:
+            await asyncio.wait_for(
+                daemon.reload_requested.wait(), CONFIG_WATCH_INTERVAL
+            )
+        except asyncio.TimeoutError:
+            pass
+        current = _config_mtime()
+        if daemon.reload_requested.is_set() or current != mtime:
+            daemon.reload_requested.clear()
+            mtime = current
+            await reload_daemon(daemon)
+
+
+@log_decorator
+async def main():
+    # systemd stops the unit with SIGTERM; take the same path as Ctrl-C.
+    loop = asyncio.get_running_loop()
+    loop.add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    try:
+        if await install_self():
+            logging.info(
+                "\033[93mExiting after installation. Please restart the script manually.\033[0m"
+            )
+            sys.exit(0)
+
+        plan = await plan_threads(benchmark=AUTO_BENCHMARK)
+        workers = await create_worker_table(plan)
+        daemon = Daemon(
+            plan=plan,
+            workers=workers,
+            pools=[PoolEndpoint(url=url) for url in POOL_HOSTS],
+        )
+        daemon.hugepages = await prepare_hugepages(plan)
+        if HUGEPAGES_REQUIRED and any(
+            achieved < pages for pages, achieved in daemon.hugepages.values()
+        ):
+            raise Exception(
+                "Huge page reservation failed and HUGEPAGES_REQUIRED is set."
+            )
+        await prepare_msr()
+
+        if await check_xmrig_running():
+            logging.info(
+                "\033[93mFound xmrig not started by this daemon, stopping it...\033[0m"
+            )
+            await kill_xmrig()
+
+        try:
+            status_server = await serve_status(daemon)
+        except OSError as e:
+            status_server = None
+            logging.warning(f"\033[93mStatus endpoint is disabled: {e}\033[0m")
+        proxy_server = None
+        if STRATUM_PROXY:
+            proxy_server = await serve_stratum_proxy(daemon)
+
+        for worker in workers.values():
+            start_supervisor(daemon, worker)
+        tasks = [
+            asyncio.create_task(collect_telemetry(workers)),
+            asyncio.create_task(monitor_loop_lag(daemon)),
+            asyncio.create_task(adapt_throttle(workers)),
+            asyncio.create_task(rank_pools(daemon)),
+            asyncio.create_task(watch_config(daemon)),
+        ]
+        if proxy_server is not None:
+            tasks.append(asyncio.create_task(run_stratum_proxy(daemon)))
+            tasks.append(asyncio.create_task(log_share_stats(daemon.proxy)))
+        loop.add_signal_handler(signal.SIGHUP, daemon.reload_requested.set)
+        if LATENCY_HISTOGRAMS:
+            loop.add_signal_handler(signal.SIGUSR1, log_latency_histograms)
+            tasks.append(asyncio.create_task(dump_latency_histograms()))
+        try:
+            await asyncio.gather(*tasks)
+        except (KeyboardInterrupt, asyncio.CancelledError):
+            logging.info("\033[93mShutdown requested, stopping...\033[0m")
+            for task in tasks + list(daemon.supervisors.values()):
+                task.cancel()
+            if status_server is not None:
+                status_server.close()
+            if proxy_server is not None:
+                proxy_server.close()
+            await stop_workers(workers)
+            await kill_xmrig()
+            sys.exit(0)
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        logging.info("\033[93mShutdown requested during startup, stopping...\033[0m")
+        await kill_xmrig()
+        sys.exit(0)
     except Exception as e:
         logging.error(f"\033[91mAn error occurred in main: {e}\033[0m")
         await kill_xmrig()
         sys.exit(1)
+    finally:
+        await loop.run_in_executor(None, release_hugepages)
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
-
+    parser = argparse.ArgumentParser(description="Myne Daemon")
+    parser.add_argument(
+        "--benchmark",
+        action="store_true",
+        help="benchmark candidate thread layouts and save the best one",
+    )
+    args = parser.parse_args()
+    try:
+        apply_settings(load_settings())
+    except (OSError, ValueError) as e:
+        logging.error(f"\033[91mInvalid configuration: {e}\033[0m")
+        sys.exit(1)
+    if args.benchmark:
+        try:
+            asyncio.run(run_benchmark())
+        finally:
+            release_hugepages()
+    else:
+        asyncio.run(main())
@@ -0,0 +1,87 @@
+"""Minimal Monero-style stratum pool for exercising the myne proxy.
+
+Run it directly (``python tests/mock_pool.py 3333``) to point a real xmrig
+or myne at it, or use :class:`MockPool` from tests.
+"""
+
+import asyncio
+import json
+import sys
+from typing import Dict, List, Optional, Set
+
+BLOB = "0c0c" + "ab" * 74  # 76-byte hashing blob, nonce at bytes 39..42
+
+
+class MockPool:
+    def __init__(self):
+        self.submits: List[dict] = []
+        self.errors: Dict[str, str] = {}
+        self.ignored: Set[str] = set()
+        self.writers: List[asyncio.StreamWriter] = []
+        self.job_number = 0
+        self.server: Optional[asyncio.AbstractServer] = None
+
+    @property
+    def port(self) -> int:
+        return self.server.sockets[0].getsockname()[1]
+
+    async def start(self, port: int = 0) -> "MockPool":
+        self.server = await asyncio.start_server(self._handle, "127.0.0.1", port)
+        return self
+
+    def close(self) -> None:
+        self.server.close()
+        for writer in self.writers:
+            writer.close()
+
+    def job(self) -> dict:
+        self.job_number += 1
+        return {
+            "blob": BLOB,
+            "job_id": f"job-{self.job_number}",
+            "target": "b88d0600",
+            "algo": "rx/0",
+        }
+
+    def broadcast_job(self) -> dict:
+        job = self.job()
+        for writer in self.writers:
+            self._send(writer, {"jsonrpc": "2.0", "method": "job", "params": job})
+        return job
+
+    @staticmethod
+    def _send(writer: asyncio.StreamWriter, message: dict) -> None:
+        writer.write(json.dumps(message).encode() + b"\n")
+
+    async def _handle(self, reader, writer) -> None:
+        self.writers.append(writer)
+        while line := await reader.readline():
+            message = json.loads(line)
+            reply = {"id": message.get("id"), "jsonrpc": "2.0", "error": None}
+            if message.get("method") == "login":
+                reply["result"] = {"id": "upstream", "job": self.job(), "status": "OK"}
+            elif message.get("method") == "submit":
+                self.submits.append(message["params"])
+                if message["params"].get("nonce") in self.ignored:
+                    continue
+                error = self.errors.get(message["params"].get("nonce"))
+                if error:
+                    reply["error"] = {"code": -1, "message": error}
+                    reply["result"] = None
+                else:
+                    reply["result"] = {"status": "OK"}
+            else:
+                reply["result"] = {"status": "KEEPALIVED"}
+            self._send(writer, reply)
+
+
+async def _serve(port: int) -> None:
+    pool = await MockPool().start(port)
+    print(f"mock pool listening on 127.0.0.1:{pool.port}")
+    while True:
+        await asyncio.sleep(30)
+        pool.broadcast_job()
+
+
+if __name__ == "__main__":
+    asyncio.run(_serve(int(sys.argv[1]) if len(sys.argv) > 1 else 3333))
@@ -0,0 +1,92 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import myne  # noqa: E402
+
+
+def topology(nodes: int = 1, cores: int = 4, threads: int = 1, l3=None):
+    # Linux numbering: the first thread of every core, then the siblings.
+    cpus = [
+        myne.CpuInfo(
+            cpu=(sibling * nodes + node) * cores + core,
+            core=core,
+            package=node,
+            node=node,
+            sibling=sibling,
+        )
+        for sibling in range(threads)
+        for node in range(nodes)
+        for core in range(cores)
+    ]
+    cpus.sort(key=lambda info: info.cpu)
+    l3_domains = []
+    if l3 is not None:
+        l3_domains = [(frozenset(info.cpu for info in cpus), l3)]
+    return myne.Topology(cpus=cpus, l3_domains=l3_domains)
+
+
+class PlannerTest(unittest.IsolatedAsyncioTestCase):
+    async def plan(self, topo):
+        return await myne.calculate_threads_and_limits(len(topo.cpus), topo)
+
+    def workers(self, plan):
+        return {worker.role: worker for worker in plan.workers}
+
+    def assertDisjoint(self, plan):
+        cpus = [cpu for worker in plan.workers for cpu in worker.cpus]
+        self.assertEqual(len(cpus), len(set(cpus)))
+
+    async def test_two_vcpus_with_smt_keep_a_main_thread(self):
+        workers = self.workers(await self.plan(topology(cores=1, threads=2)))
+        self.assertEqual((workers["main"].threads, workers["main"].cpus), (1, [0]))
+        self.assertEqual(workers["limited"].cpus, [1])
+
+    async def test_limited_takes_a_hyperthread_not_a_core(self):
+        workers = self.workers(await self.plan(topology(cores=2, threads=2)))
+        self.assertEqual(workers["main"].cpus, [0, 1, 2])
+        self.assertEqual(workers["limited"].cpus, [3])
+
+    async def test_limited_shares_the_free_core(self):
+        plan = await self.plan(topology(cores=4, threads=2))
+        workers = self.workers(plan)
+        self.assertEqual(workers["free"].cpus, [3])
+        self.assertEqual(workers["limited"].cpus, [7])
+        self.assertEqual(workers["main"].cpus, [0, 1, 2, 4, 5, 6])
+        self.assertDisjoint(plan)
+
+    async def test_without_smt(self):
+        workers = self.workers(await self.plan(topology(cores=8)))
+        self.assertEqual(workers["main"].cpus, [0, 1, 2, 3, 4, 5])
+        self.assertEqual(workers["limited"].cpus, [6])
+        self.assertEqual(workers["free"].cpus, [7])
+
+    async def test_multi_node(self):
+        plan = await self.plan(topology(nodes=2, cores=4))
+        workers = self.workers(plan)
+        self.assertEqual(workers["main-node0"].cpus, [0, 1, 2, 3])
+        self.assertEqual(workers["main-node1"].cpus, [4, 5])
+        self.assertEqual((workers["free"].node, workers["limited"].node), (1, 1))
+        self.assertDisjoint(plan)
+
+    async def test_small_l3_still_plans_a_main_thread(self):
+        plan = await self.plan(topology(cores=4, l3=myne.RANDOMX_SCRATCHPAD // 2))
+        self.assertEqual(plan.role_threads("main"), 1)
+
+    async def test_main_keeps_the_baseline_thread_count(self):
+        for nodes in (1, 2):
+            for cores in range(1, 9):
+                for threads in (1, 2):
+                    topo = topology(nodes, cores, threads)
+                    count = len(topo.cpus)
+                    expected = count - (2 if count >= myne.CPU_LIMIT_THRESHOLD else 1)
+                    with self.subTest(nodes=nodes, cores=cores, threads=threads):
+                        plan = await self.plan(topo)
+                        self.assertEqual(plan.role_threads("main"), expected)
+                        self.assertDisjoint(plan)
+
+
+if __name__ == "__main__":
+    unittest.main()
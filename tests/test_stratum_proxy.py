@@ -0,0 +1,144 @@
+import asyncio
+import json
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import myne  # noqa: E402
+from mock_pool import MockPool  # noqa: E402
+
+
+class StratumClient:
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    @classmethod
+    async def connect(cls, port: int) -> "StratumClient":
+        return cls(*await asyncio.open_connection("127.0.0.1", port))
+
+    async def call(self, request_id, method: str, params: dict) -> dict:
+        self.writer.write(
+            json.dumps({"id": request_id, "method": method, "params": params}).encode()
+            + b"\n"
+        )
+        return await self.read()
+
+    async def read(self) -> dict:
+        return json.loads(await asyncio.wait_for(self.reader.readline(), 5))
+
+    def close(self) -> None:
+        self.writer.close()
+
+
+class StratumProxyTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.pool = await MockPool().start()
+        self.endpoint = myne.PoolEndpoint(url=f"127.0.0.1:{self.pool.port}")
+        self.daemon = myne.Daemon(
+            plan=myne.ThreadPlan(workers=[]), workers={}, pools=[self.endpoint]
+        )
+        self.proxy_port = myne.PROXY_PORT
+        myne.PROXY_PORT = 0
+        self.server = await myne.serve_stratum_proxy(self.daemon)
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.upstream = asyncio.create_task(myne.run_stratum_proxy(self.daemon))
+        self.clients = []
+
+    async def asyncTearDown(self):
+        for client in self.clients:
+            client.close()
+        self.upstream.cancel()
+        self.server.close()
+        self.pool.close()
+        myne.PROXY_PORT = self.proxy_port
+
+    async def login(self, rigid: str):
+        client = await StratumClient.connect(self.port)
+        self.clients.append(client)
+        reply = await client.call(1, "login", {"login": "x", "rigid": rigid})
+        return client, reply["result"]
+
+    async def test_workers_get_distinct_nonce_bytes(self):
+        (_, first), (_, second) = [await self.login(n) for n in ("main", "free")]
+        self.assertNotEqual(first["id"], second["id"])
+        self.assertNotEqual(first["job"]["blob"][84:86], second["job"]["blob"][84:86])
+        self.assertEqual(first["job"]["blob"][:84], second["job"]["blob"][:84])
+        self.assertEqual(first["job"]["blob"][86:], second["job"]["blob"][86:])
+
+    async def test_new_jobs_keep_each_workers_nonce_byte(self):
+        (main, login_main), (free, login_free) = [
+            await self.login(n) for n in ("main", "free")
+        ]
+        job = self.pool.broadcast_job()
+        pushed_main, pushed_free = await main.read(), await free.read()
+        self.assertEqual(pushed_main["params"]["job_id"], job["job_id"])
+        self.assertEqual(
+            pushed_main["params"]["blob"][84:86], login_main["job"]["blob"][84:86]
+        )
+        self.assertEqual(
+            pushed_free["params"]["blob"][84:86], login_free["job"]["blob"][84:86]
+        )
+
+    async def test_submit_replies_are_routed_and_counted(self):
+        (main, login_main), (free, login_free) = [
+            await self.login(n) for n in ("main", "free")
+        ]
+        self.pool.errors = {
+            "00000002": "Stale share",
+            "00000003": "Low difficulty share",
+        }
+        job_id = login_main["job"]["job_id"]
+
+        # Reuse the same request id on both clients to check routing.
+        accepted = await main.call(7, "submit", {"job_id": job_id, "nonce": "00000001"})
+        stale = await free.call(7, "submit", {"job_id": job_id, "nonce": "00000002"})
+        rejected = await free.call(8, "submit", {"job_id": job_id, "nonce": "00000003"})
+
+        self.assertEqual((accepted["id"], accepted["result"]), (7, {"status": "OK"}))
+        self.assertEqual((stale["id"], stale["error"]["message"]), (7, "Stale share"))
+        self.assertEqual(rejected["id"], 8)
+        self.assertEqual(
+            [submit["id"] for submit in self.pool.submits], ["upstream"] * 3
+        )
+
+        shares = self.daemon.proxy.shares
+        main_stats = shares[("main", self.endpoint.url)]
+        free_stats = shares[("free", self.endpoint.url)]
+        self.assertEqual(
+            (main_stats.accepted, main_stats.stale, main_stats.rejected), (1, 0, 0)
+        )
+        self.assertEqual(
+            (free_stats.accepted, free_stats.stale, free_stats.rejected), (0, 1, 1)
+        )
+        self.assertEqual(free_stats.job_latency.count, 1)
+        self.assertEqual((self.endpoint.accepted, self.endpoint.rejected), (1, 2))
+
+    async def test_login_again_keeps_the_slot(self):
+        client, first = await self.login("main")
+        again = await client.call(2, "login", {"login": "x", "rigid": "main"})
+        self.assertEqual(again["result"]["id"], first["id"])
+        self.assertEqual(
+            again["result"]["job"]["blob"][84:86], first["job"]["blob"][84:86]
+        )
+        self.assertEqual(len(self.daemon.proxy.clients), 1)
+
+    async def test_unanswered_submit_expires(self):
+        client, login = await self.login("main")
+        self.pool.ignored = {"00000009"}
+        myne.PROXY_SUBMIT_TIMEOUT, timeout = 0.1, myne.PROXY_SUBMIT_TIMEOUT
+        try:
+            reply = await client.call(
+                5, "submit", {"job_id": login["job"]["job_id"], "nonce": "00000009"}
+            )
+        finally:
+            myne.PROXY_SUBMIT_TIMEOUT = timeout
+        self.assertEqual(reply["id"], 5)
+        self.assertIsNotNone(reply["error"])
+        self.assertEqual(self.daemon.proxy.pending, {})
+
+
+if __name__ == "__main__":
+    unittest.main()